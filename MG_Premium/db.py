@@ -1,10 +1,11 @@
 # db.py
-import os, yaml, pathlib, sys
+import os, sys
 #choose which connector to use
 import pyodbc #for SQL SERVER
 #import mysql.connector
 
 from dotenv import load_dotenv
+from settings import load_settings
 
 load_dotenv()
 
@@ -15,40 +16,57 @@ Q  = ("[", "]")   # identifier quotes for SQL Server
 def _q(name: str) -> str:
     return f"{Q[0]}{name}{Q[1]}"
 
-_cfg = yaml.safe_load(pathlib.Path("config.yaml").read_text(encoding="utf-8"))
+settings = load_settings()
+_db = settings.db
 
 # Main table config
-MAIN_TABLE    = _cfg["db"]["table"]
-MAIN_ID_COL   = _cfg["db"]["id_col"]
+MAIN_TABLE    = _db.table
+MAIN_ID_COL   = _db.id_col
 
 # Sync table config
-SYNC_TABLE            = _cfg["db"]["sync_table"]
-SYNC_REF_COL          = _cfg["db"]["sync_product_ref_col"]
-SYNC_UPLOADED_COL     = _cfg["db"]["sync_uploaded_col"]
-SYNC_EXTERNAL_COL     = _cfg["db"]["sync_external_id_col"]
-SYNC_PARENT_COL      = _cfg["db"]["sync_parent_id_col"]
-SYNC_UPLOADED_DATE    = _cfg["db"]["sync_uploaded_date_col"]
-SYNC_UPDATED_DATE     = _cfg["db"]["sync_updated_date_col"]
+SYNC_TABLE            = _db.sync_table
+SYNC_REF_COL          = _db.sync_product_ref_col
+SYNC_UPLOADED_COL     = _db.sync_uploaded_col
+SYNC_EXTERNAL_COL     = _db.sync_external_id_col
+SYNC_PARENT_COL       = _db.sync_parent_id_col
+SYNC_UPLOADED_DATE    = _db.sync_uploaded_date_col
+SYNC_UPDATED_DATE     = _db.sync_updated_date_col
+SYNC_PUSHED_HASH_COL  = _db.sync_pushed_hash_col     # empty = push every row
 
-STYLE_COL = _cfg.get("updater", {}).get("style_col", "J_Style")
-SIZE_COL  = _cfg.get("updater", {}).get("size_col",  "b_Size")
-STOCK_COLS = _cfg.get("stock_columns", [])
-BARCODE_COL = _cfg["db"].get("barcode_col", "Barcode") 
+STYLE_COL = settings.updater.style_col                 # empty = no J_Style aggregation
+SIZE_COL  = settings.updater.size_col
+_upd = settings.updater
+CHANGE_SOURCE    = _upd.change_source                  # rowversion | change_tracking
+ROWVERSION_COLS  = list(_upd.rowversion_cols)
+CHANGE_TABLES    = list(_upd.change_tables)
+CHANGE_KEY_COL   = _upd.change_key_col
+CHANGE_MATCH_COL = _upd.change_match_col or MAIN_ID_COL
+STOCK_COLS = list(settings.stock_columns)
+BARCODE_COL = settings.barcode_col
+FETCH_CHUNK = _db.fetch_chunk_size
+EXTRA_COLS  = list(_db.extra_columns)                  # columns only custom helpers read
+
+# Parent key columns – must match transform.concat_style_color()
+PARENT_KEY_COLS = ("b_Style", "b_Color")
 
 
 class DB:
 
+    @staticmethod
+    def _connect():
+        conn_str = (
+            f"DRIVER={{{os.getenv('ODBC_DRIVER', 'ODBC Driver 18 for SQL Server')}}};"
+            f"SERVER={os.getenv('DB_HOST')},{os.getenv('DB_PORT', '1433')};"
+            f"DATABASE={os.getenv('DB_NAME')};"
+            f"UID={os.getenv('DB_USER')};"
+            f"PWD={os.getenv('DB_PASS')};"
+            f"TrustServerCertificate=yes;"
+        )
+        return pyodbc.connect(conn_str)
+
     def __init__(self):
         try:
-            conn_str = (
-                f"DRIVER={{{os.getenv('ODBC_DRIVER', 'ODBC Driver 18 for SQL Server')}}};"
-                f"SERVER={os.getenv('DB_HOST')},{os.getenv('DB_PORT', '1433')};"
-                f"DATABASE={os.getenv('DB_NAME')};"
-                f"UID={os.getenv('DB_USER')};"
-                f"PWD={os.getenv('DB_PASS')};"
-                f"TrustServerCertificate=yes;"
-            )
-            self.conn = pyodbc.connect(conn_str)
+            self.conn = self._connect()
 
             def _q(name: str) -> str:          # helper: quote identifiers once
                 return f"{Q[0]}{name}{Q[1]}"
@@ -66,27 +84,57 @@ class DB:
             print(f"[DB ERROR] Unexpected error during DB connection: {ex}")
             sys.exit(1)
 
-    def fetch_new_rows(self, barcodes: set[str] | None = None): 
+    def _new_rows_sql(self, barcodes: set[str] | None = None,
+                      columns: list[str] | None = None,
+                      filters: dict[str, set[str]] | None = None) -> tuple[str, list]:
         """
-        Return all rows from the main table where the sync table says uploaded=0.
+        SELECT of every main-table row whose sync row says uploaded=0 (+ optional barcode filter).
+        columns → project only these (plus barcode_col and db.extra_columns) instead of m.*.
+        filters → {column: allowed lower-case values}, matched trimmed and case-insensitive.
         """
-        try:
-            cur = self.conn.cursor()
-            params = []
-            sql = (
-                f"SELECT m.{_q(MAIN_ID_COL)} AS id, m.* "
-                f"FROM {_q(MAIN_TABLE)} AS m "
-                f"JOIN {_q(SYNC_TABLE)} AS s "
-                f"  ON m.{_q(MAIN_ID_COL)} = s.{_q(SYNC_REF_COL)} "
-                f"WHERE s.{_q(SYNC_UPLOADED_COL)} = 0"
-            )
-            params: list[str] = []
+        if columns:
+            wanted = list(dict.fromkeys([*columns, BARCODE_COL, *EXTRA_COLS]))
+            select = ", ".join(f"m.{_q(c)}" for c in wanted)
+        else:
+            select = "m.*"
+        sql = (
+            f"SELECT m.{_q(MAIN_ID_COL)} AS id, {select} "
+            f"FROM {_q(MAIN_TABLE)} AS m "
+            f"JOIN {_q(SYNC_TABLE)} AS s "
+            f"  ON m.{_q(MAIN_ID_COL)} = s.{_q(SYNC_REF_COL)} "
+            f"WHERE s.{_q(SYNC_UPLOADED_COL)} = 0"
+        )
+        params: list[str] = []
 
-            if barcodes:                                      # force-barcode mode
-                ph = ", ".join([PH] * len(barcodes))          # '?' or '%s'
-                sql += f" AND TRIM(m.{_q(BARCODE_COL)}) IN ({ph})"
-                params.extend(barcodes)
+        if barcodes:                                      # force-barcode mode
+            ph = ", ".join([PH] * len(barcodes))          # '?' or '%s'
+            sql += f" AND TRIM(m.{_q(BARCODE_COL)}) IN ({ph})"
+            params.extend(barcodes)
 
+        for col, allowed in (filters or {}).items():      # brand / season pushdown
+            if not allowed:
+                sql += " AND 1 = 0"                       # empty whitelist lets nothing through
+                continue
+            ph = ", ".join([PH] * len(allowed))
+            sql += f" AND LOWER(LTRIM(RTRIM(m.{_q(col)}))) IN ({ph})"
+            params.extend(sorted(allowed))
+        return sql, params
+
+    def table_columns(self) -> set[str]:
+        """Column names of the main table / view (lower-case), read from an empty SELECT."""
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT TOP 0 * FROM {_q(MAIN_TABLE)}")
+        names = {desc[0].lower() for desc in cur.description}
+        cur.close()
+        return names
+
+    def fetch_new_rows(self, barcodes: set[str] | None = None, columns: list[str] | None = None,
+                       filters: dict[str, set[str]] | None = None): 
+        """
+        Return all rows from the main table where the sync table says uploaded=0.
+        """
+        try:
+            sql, params = self._new_rows_sql(barcodes, columns, filters)
             print(f"[DB] Executing: {sql}")
             cur = self.conn.cursor()
             cur.execute(sql, params)                          # param list now matches
@@ -98,6 +146,55 @@ class DB:
             print(f"[DB ERROR] Failed to fetch new rows: {ex}")
             return []
 
+    def iter_new_buckets(self, barcodes: set[str] | None = None, chunk_size: int | None = None,
+                         columns: list[str] | None = None, filters: dict[str, set[str]] | None = None):
+        """
+        Streaming fetch_new_rows(): the server orders by the parent key (style, color),
+        rows are read with fetchmany(chunk_size) and one complete bucket (list of row
+        dicts of the same parent) is yielded at a time.
+        Uses its own connection, so mark_uploaded*/touch_updated* can run on self.conn
+        while the result set is still open.
+        columns / filters → projected SELECT list and WHERE pushdown, see _new_rows_sql().
+        """
+        # binary collation: equal keys are adjacent exactly as Python compares them
+        style, color = (f"LTRIM(RTRIM(m.{_q(c)})) COLLATE Latin1_General_BIN2" for c in PARENT_KEY_COLS)
+        sql, params = self._new_rows_sql(barcodes, columns, filters)
+        sql += f" ORDER BY {style}, {color}"
+        chunk_size = chunk_size or FETCH_CHUNK
+
+        conn = cur = None
+        try:
+            conn = self._connect()
+            cur  = conn.cursor()
+            print(f"[DB] Executing: {sql}")
+            cur.execute(sql, params)
+            columns = [desc[0] for desc in cur.description]
+
+            bucket, bucket_key = [], None
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                for raw in chunk:
+                    row = dict(zip(columns, raw))
+                    key = tuple(str(row.get(c) or "").strip() for c in PARENT_KEY_COLS)
+                    if bucket and key != bucket_key:
+                        yield bucket
+                        bucket = []
+                    bucket_key = key
+                    bucket.append(row)
+            if bucket:
+                yield bucket
+        except Exception as ex:
+            # a half-read stream must fail the run, not look like "no more rows"
+            print(f"[DB ERROR] Failed to stream new rows: {ex}")
+            raise
+        finally:
+            if cur is not None:
+                cur.close()
+            if conn is not None:
+                conn.close()
+
     def mark_uploaded(self, product_ref_id, parent_id=None, external_id=None):
         """
         Mark the sync row as uploaded, store variation id, parent id and set timestamps.
@@ -135,10 +232,104 @@ class DB:
         except Exception as ex:
             print(f"[DB ERROR] Failed to mark product as uploaded (product_ref_id={product_ref_id}): {ex}")
 
-    def fetch_products_for_update(self):
+    def _bulk_update(self, temp_ddl: str, rows: list[tuple], update_sql: str) -> int:
+        """
+        Load rows into a session temp table with fast_executemany, run one set-based
+        UPDATE … JOIN against it and commit once. Returns the number of rows updated.
+        temp_ddl is "#name (col TYPE, …)"; the INSERT column count follows the tuples.
+        """
+        temp_name = temp_ddl.split("(", 1)[0].strip()
+        cur = self.conn.cursor()
+        try:
+            cur.execute(f"CREATE TABLE {temp_ddl}")
+            cur.fast_executemany = True
+            ph = ", ".join([PH] * len(rows[0]))
+            cur.executemany(f"INSERT INTO {temp_name} VALUES ({ph})", rows)
+            cur.execute(update_sql)
+            updated = cur.rowcount
+            cur.execute(f"DROP TABLE {temp_name}")
+            self.conn.commit()
+            return updated
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def mark_uploaded_many(self, items: list[tuple]) -> bool:
+        """
+        Bulk mark_uploaded(): items are (product_ref_id, parent_id, external_id) tuples.
+        None for parent_id / external_id leaves the stored value untouched, like mark_uploaded.
+        Returns False when the write failed (already rolled back and printed).
+        """
+        if not items:
+            return True
+        try:
+            self._bulk_update(
+                "#sync_marks (ref_id BIGINT PRIMARY KEY, parent_id BIGINT NULL, external_id BIGINT NULL)",
+                [tuple(it) for it in items],
+                f"UPDATE s SET "
+                f"  s.[{SYNC_UPLOADED_COL}] = 1, "
+                f"  s.[{SYNC_UPDATED_DATE}] = GETDATE(), "
+                f"  s.[{SYNC_PARENT_COL}]   = COALESCE(t.parent_id, s.[{SYNC_PARENT_COL}]), "
+                f"  s.[{SYNC_EXTERNAL_COL}] = COALESCE(t.external_id, s.[{SYNC_EXTERNAL_COL}]), "
+                f"  s.[{SYNC_UPLOADED_DATE}] = CASE WHEN t.external_id IS NOT NULL "
+                f"      THEN COALESCE(s.[{SYNC_UPLOADED_DATE}], GETDATE()) ELSE s.[{SYNC_UPLOADED_DATE}] END "
+                f"FROM [{SYNC_TABLE}] AS s JOIN #sync_marks AS t ON s.[{SYNC_REF_COL}] = t.ref_id",
+            )
+        except Exception as ex:
+            print(f"[DB ERROR] Failed to mark {len(items)} product(s) as uploaded: {ex}")
+            return False
+        return True
+
+    # ---------------------------------------------------------------
+    #  change capture for the incremental updater
+    # ---------------------------------------------------------------
+    def change_marker(self) -> int:
+        """
+        Current change position of the source, read BEFORE the rows:
+          rowversion      → MIN_ACTIVE_ROWVERSION() - 1 (everything below is committed)
+          change_tracking → CHANGE_TRACKING_CURRENT_VERSION()
+        """
+        sql = ("SELECT CHANGE_TRACKING_CURRENT_VERSION()" if CHANGE_SOURCE == "change_tracking"
+               else "SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1")
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        marker = cur.fetchone()[0]
+        cur.close()
+        return int(marker or 0)
+
+    def _changed_ids_sql(self, since: int):
+        """
+        (sql, params) selecting the MAIN_ID_COL of rows changed after `since`,
+        or None when change tracking no longer covers `since` (→ full scan).
+        """
+        if CHANGE_SOURCE == "change_tracking":
+            cur = self.conn.cursor()
+            for table in CHANGE_TABLES:
+                cur.execute("SELECT CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?))", (table,))
+                min_valid = cur.fetchone()[0]
+                if min_valid is None or since < min_valid:
+                    cur.close()
+                    print(f"[DB] Change tracking on {table} no longer covers version {since}, full scan")
+                    return None
+            cur.close()
+            parts = [
+                f"SELECT r.[{MAIN_ID_COL}] FROM [{MAIN_TABLE}] r "
+                f"JOIN CHANGETABLE(CHANGES {table}, ?) AS ct ON ct.[{CHANGE_KEY_COL}] = r.[{CHANGE_MATCH_COL}]"
+                for table in CHANGE_TABLES
+            ]
+            return " UNION ".join(parts), [since] * len(parts)
+
+        cond = " OR ".join(f"r.[{c}] > CAST(CAST(? AS BIGINT) AS BINARY(8))" for c in ROWVERSION_COLS)
+        return f"SELECT r.[{MAIN_ID_COL}] FROM [{MAIN_TABLE}] r WHERE {cond}", [since] * len(ROWVERSION_COLS)
+
+    def fetch_products_for_update(self, since: int | None = None):
         """
         Return everything the updater needs:
           Woo ID, price, style, size and ALL stock columns.
+        since: change marker of the last successful run → only rows changed after it,
+        plus their (style, size) siblings when J_Style aggregation is on. None = all rows.
         """
         stock_select = ", ".join([f"m.[{c}]" for c in STOCK_COLS])
         # -----------------------------------------------------------------
@@ -151,6 +342,8 @@ class DB:
             f"s.[{SYNC_PARENT_COL}]   AS parent_id",
             f"m.[RP]                  AS price",
         ]
+        if SYNC_PUSHED_HASH_COL:
+            select_parts.append(f"s.[{SYNC_PUSHED_HASH_COL}] AS pushed_hash")
         if STYLE_COL:
             select_parts.append(f"m.[{STYLE_COL}] AS j_style")
             select_parts.append(f"m.[{SIZE_COL}]  AS size")
@@ -164,7 +357,43 @@ class DB:
             f" WHERE s.[{SYNC_UPLOADED_COL}] = 1"
             f"   AND s.[{SYNC_EXTERNAL_COL}] IS NOT NULL"
         )
+        params = []
+        changed = self._changed_ids_sql(since) if since is not None else None
+        if changed:
+            ids_sql, ids_params = changed
+            sql += f" AND (m.[{MAIN_ID_COL}] IN ({ids_sql})"
+            params += ids_params
+            if STYLE_COL:
+                # a changed row changes the J_Style total of every row sharing its (style, size)
+                sql += (
+                    f" OR EXISTS (SELECT 1 FROM [{MAIN_TABLE}] c"
+                    f"            WHERE c.[{STYLE_COL}] = m.[{STYLE_COL}] AND c.[{SIZE_COL}] = m.[{SIZE_COL}]"
+                    f"              AND c.[{MAIN_ID_COL}] IN ({ids_sql}))"
+                )
+                params += ids_params
+            sql += ")"
 
+        cur = self.conn.cursor()
+        print("[DB] Executing:", sql)
+        cur.execute(sql, params)
+        columns = [desc[0] for desc in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+        cur.close()
+        return rows
+
+    def fetch_synced_skus(self):
+        """
+        Rows already uploaded to Woo, with the columns the SKUs are built from
+        (b_Style, b_Color, b_Size) and their Woo IDs – used to seed Woo.skus.
+        """
+        sql = (
+            f"SELECT m.[b_Style], m.[b_Color], m.[{SIZE_COL}] AS size, "
+            f"       s.[{SYNC_PARENT_COL}] AS parent_id, s.[{SYNC_EXTERNAL_COL}] AS woo_id "
+            f"FROM [{MAIN_TABLE}] m "
+            f"JOIN [{SYNC_TABLE}] s ON m.[{MAIN_ID_COL}] = s.[{SYNC_REF_COL}] "
+            f"WHERE s.[{SYNC_UPLOADED_COL}] = 1 "
+            f"  AND s.[{SYNC_PARENT_COL}] IS NOT NULL"
+        )
         cur = self.conn.cursor()
         print("[DB] Executing:", sql)
         cur.execute(sql)
@@ -173,21 +402,48 @@ class DB:
         cur.close()
         return rows
 
-    def touch_updated(self, product_ref_id: int) -> None:
-        """Just stamp updated_date = NOW() for one row in the sync table."""
+    def touch_updated(self, product_ref_id: int, pushed_hash: str | None = None) -> None:
+        """
+        Stamp updated_date = NOW() for one row in the sync table.
+        If pushed_hash is given (and the column is configured), store the
+        fingerprint of the price/stock we just pushed as well.
+        """
         try:
             cur = self.conn.cursor()
-            cur.execute(
-                f"UPDATE [{SYNC_TABLE}] "
-                f"SET [{SYNC_UPDATED_DATE}] = GETDATE() "
-                f"WHERE [{SYNC_REF_COL}] = ?",
-                (product_ref_id,)
-            )
+            sql = f"UPDATE [{SYNC_TABLE}] SET [{SYNC_UPDATED_DATE}] = GETDATE()"
+            params = []
+            if SYNC_PUSHED_HASH_COL and pushed_hash is not None:
+                sql += f", [{SYNC_PUSHED_HASH_COL}] = ?"
+                params.append(pushed_hash)
+            sql += f" WHERE [{SYNC_REF_COL}] = ?"
+            params.append(product_ref_id)
+            cur.execute(sql, params)
             self.conn.commit()
             cur.close()
         except Exception as ex:
             print(f"[DB ERROR] touch_updated({product_ref_id}) → {ex}")
 
+    def touch_updated_many(self, items: list[tuple]) -> None:
+        """
+        Bulk touch_updated(): items are (product_ref_id, pushed_hash) tuples,
+        pushed_hash may be None. One UPDATE … JOIN and a single commit.
+        """
+        if not items:
+            return
+        set_hash = (
+            f", s.[{SYNC_PUSHED_HASH_COL}] = COALESCE(t.pushed_hash, s.[{SYNC_PUSHED_HASH_COL}])"
+            if SYNC_PUSHED_HASH_COL else ""
+        )
+        try:
+            self._bulk_update(
+                "#sync_touch (ref_id BIGINT PRIMARY KEY, pushed_hash VARCHAR(64) NULL)",
+                [tuple(it) for it in items],
+                f"UPDATE s SET s.[{SYNC_UPDATED_DATE}] = GETDATE(){set_hash} "
+                f"FROM [{SYNC_TABLE}] AS s JOIN #sync_touch AS t ON s.[{SYNC_REF_COL}] = t.ref_id",
+            )
+        except Exception as ex:
+            print(f"[DB ERROR] touch_updated_many({len(items)} rows) → {ex}")
+
     # ----------------------------------------------------------------------
     #  NEW: sum the stock of *every* row that matches a (J_Style , Size) pair
     # ----------------------------------------------------------------------
@@ -209,3 +465,35 @@ class DB:
         total = result[0] if result else 0
         return int(total or 0)
 
+    def fetch_jstyle_stock_totals(self, styles=None) -> dict[tuple, int]:
+        """
+        Same aggregate as sum_stock_for_jstyle_size(), for every (style, size) at once:
+        one GROUP BY pass, returned as {(style, size): total}. Only keys shared by
+        more than one row are returned – single rows need no aggregation.
+        styles: limit the pass to these J_Style values (incremental runs).
+        """
+        sum_expr = " + ".join([f"COALESCE([{c}],0)" for c in STOCK_COLS]) or "0"
+        base = (
+            f"SELECT [{STYLE_COL}] AS j_style, [{SIZE_COL}] AS size, SUM({sum_expr}) AS total "
+            f"FROM [{MAIN_TABLE}] "
+            f"WHERE [{STYLE_COL}] IS NOT NULL "
+        )
+        tail = f"GROUP BY [{STYLE_COL}], [{SIZE_COL}] HAVING COUNT(*) > 1"
+        if styles is None:
+            chunks = [None]
+        else:
+            styles = sorted(set(styles))
+            chunks = [styles[i:i + 1000] for i in range(0, len(styles), 1000)]   # pyodbc: max 2100 params
+        totals = {}
+        cur = self.conn.cursor()
+        for chunk in chunks:
+            sql, params = base, []
+            if chunk is not None:
+                sql += f"AND [{STYLE_COL}] IN ({', '.join('?' * len(chunk))}) "
+                params = chunk
+            sql += tail
+            print("[DB] Executing:", sql if chunk is None else f"{base}AND [{STYLE_COL}] IN (<{len(chunk)} styles>) {tail}")
+            cur.execute(sql, params)
+            totals.update({(style, size): int(total or 0) for style, size, total in cur.fetchall()})
+        cur.close()
+        return totals
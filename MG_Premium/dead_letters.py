@@ -0,0 +1,150 @@
+# dead_letters.py  – persisted queue of failed Woo items
+# -------------------------------------------------
+#  • main.py (parents, variations) and product_updater.py (price/stock
+#    updates) record every item Woo refused: payload, endpoint, error
+#    code/message and how often it failed.
+#  • `python main.py retry` replays only these items; a failed replay is
+#    pushed back with exponential backoff (backoff_base * 2**attempts)
+#    until dead_letters.max_attempts is reached.
+#  • Items that later succeed (retry or a normal run) are removed.
+#  • While an item waits for its backoff (or was given up), normal runs
+#    leave it alone unless its payload changed – the queue owns it.
+#  • `python main.py retry --reset [key]` gives given-up items new attempts.
+# -------------------------------------------------
+import json, sqlite3, threading, time
+from dataclasses import dataclass
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    kind        TEXT NOT NULL,          -- parent | variation | update
+    item_key    TEXT NOT NULL,          -- parent SKU / DB row id
+    endpoint    TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    meta        TEXT,
+    error_code  TEXT,
+    message     TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 1,
+    next_at     REAL NOT NULL,
+    first_at    REAL NOT NULL,
+    last_at     REAL NOT NULL,
+    PRIMARY KEY (kind, item_key)
+);
+"""
+
+
+@dataclass
+class DeadLetter:
+    kind: str
+    key: str
+    endpoint: str
+    payload: dict
+    meta: dict
+    error_code: str | None
+    message: str | None
+    attempts: int
+    next_at: float
+
+
+def open_dead_letters(cfg) -> "DeadLetters":
+    """DeadLetters from the typed dead_letters config section."""
+    return DeadLetters(cfg.path, cfg.backoff_base, cfg.max_attempts)
+
+
+def error_of(resp) -> tuple[str | None, str]:
+    """(code, message) of a Woo error answer, a batch item with "error", or an exception."""
+    if isinstance(resp, Exception):
+        return type(resp).__name__, str(resp)
+    err = resp.get("error") if isinstance(resp.get("error"), dict) else resp
+    return err.get("code"), err.get("message") or json.dumps(err)
+
+
+class DeadLetters:
+    """SQLite dead-letter queue, safe to use from the sync threads."""
+
+    def __init__(self, path: str | None = None, backoff_base: float = 30, max_attempts: int = 5, clock=time.time):
+        self.path  = path or ":memory:"
+        self.backoff_base = backoff_base
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def add(self, kind, key, endpoint, payload, resp, meta=None):
+        """Record (or re-record, attempts + 1) one failed item; resp is the Woo answer or the exception."""
+        code, message = error_of(resp)
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM dead_letters WHERE kind = ? AND item_key = ?",
+                                     (kind, str(key))).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            self._conn.execute(
+                "INSERT INTO dead_letters (kind, item_key, endpoint, payload, meta, error_code, message, "
+                "                          attempts, next_at, first_at, last_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind, item_key) DO UPDATE SET endpoint = excluded.endpoint, payload = excluded.payload, "
+                "  meta = excluded.meta, error_code = excluded.error_code, message = excluded.message, "
+                "  attempts = excluded.attempts, next_at = excluded.next_at, last_at = excluded.last_at",
+                (kind, str(key), endpoint, json.dumps(payload), json.dumps(meta or {}), code, message,
+                 attempts, now + self.backoff_base * 2 ** (attempts - 1), now, now))
+
+    def resolve(self, kind, keys):
+        """Forget items that went through after all."""
+        keys = [(kind, str(k)) for k in keys]
+        if keys:
+            with self._lock:
+                self._conn.executemany("DELETE FROM dead_letters WHERE kind = ? AND item_key = ?", keys)
+
+    def holds(self, kind, key, payload=None) -> bool:
+        """
+        True while the queue owns this item: it is waiting for its backoff or was given up.
+        A different payload (the data was fixed at the source) is not held.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, attempts, next_at FROM dead_letters WHERE kind = ? AND item_key = ?",
+                (kind, str(key))).fetchone()
+        if row is None:
+            return False
+        if payload is not None and json.loads(row[0]) != json.loads(json.dumps(payload)):
+            return False
+        return row[1] >= self.max_attempts or row[2] > self.clock()
+
+    def reset(self, key=None) -> int:
+        """Give exhausted items (or only `key`) a fresh set of attempts, due now. Returns how many."""
+        sql    = "UPDATE dead_letters SET attempts = 0, next_at = ? WHERE attempts >= ?"
+        params = [self.clock(), self.max_attempts]
+        if key is not None:
+            sql += " AND item_key = ?"
+            params.append(str(key))
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def due(self, now=None) -> list[DeadLetter]:
+        """Items whose backoff has passed and that still have attempts left."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, item_key, endpoint, payload, meta, error_code, message, attempts, next_at "
+                "FROM dead_letters WHERE next_at <= ? AND attempts < ? ORDER BY next_at",
+                (self.clock() if now is None else now, self.max_attempts)).fetchall()
+        return [DeadLetter(k, key, ep, json.loads(p), json.loads(m or "{}"), code, msg, n, nxt)
+                for k, key, ep, p, m, code, msg, n, nxt in rows]
+
+    def next_due(self) -> float | None:
+        """When the next retryable item is due (None = nothing left to retry)."""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_at) FROM dead_letters WHERE attempts < ?",
+                                     (self.max_attempts,)).fetchone()
+        return row[0]
+
+    def exhausted(self) -> list[tuple]:
+        """(kind, key, error_code, message) of items that reached max_attempts."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, item_key, error_code, message FROM dead_letters WHERE attempts >= ? "
+                "ORDER BY kind, item_key", (self.max_attempts,)).fetchall()
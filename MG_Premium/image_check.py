@@ -0,0 +1,106 @@
+# image_check.py  – HEAD pre-flight for product image URLs
+# -------------------------------------------------
+#  • Before a parent goes to Woo, every images[].src is HEAD-checked
+#    (several at once); URLs that are missing are dropped from the payload,
+#    so one bad photo no longer costs a failed sideload + a re-POST that
+#    also throws away the good photos.
+#  • Answers are cached for images.preflight_ttl seconds. Only definite
+#    answers are cached: timeouts / 5xx count as "present" and let Woo decide.
+#  • Woo passes its shared session and throttle, so the checks use the
+#    kept-alive connections and count against the request pace. While the
+#    Woo circuit is not closed the check is skipped (images are kept).
+#  • The session and clock are injectable, so it can be pointed at a local
+#    HTTP stand-in.
+# -------------------------------------------------
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+_MISSING = (404, 410)
+
+
+class ImagePreflight:
+    """Concurrent, TTL-cached "does this image URL exist?" checks."""
+
+    def __init__(self, session=None, ttl: float = 3600, workers: int = 8, timeout: float = 5, clock=time.monotonic,
+                 throttle=None, breaker=None):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount("https://", adapter)
+            session.mount("http://",  adapter)
+        self.session = session
+        self.ttl     = ttl
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.clock   = clock
+        self.throttle = throttle            # woo_api AdaptiveThrottle / RateLimiter, paces every check
+        self.breaker  = breaker             # woo_api CircuitBreaker, only read: no checks while not closed
+        self._seen   = {}                  # url -> (exists, checked_at)
+        self._lock   = threading.Lock()
+
+    def _head(self, url):
+        """True / False for a definite answer, None when the server could not tell."""
+        try:
+            if self.throttle:
+                self.throttle.acquire()
+            r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+            if r.status_code in (405, 501):                  # HEAD not allowed → ask for the headers only
+                if self.throttle:
+                    self.throttle.acquire()
+                r = self.session.get(url, timeout=self.timeout, stream=True)
+                r.close()
+        except requests.RequestException:
+            return None
+        if r.status_code in _MISSING:
+            return False
+        if r.status_code >= 400:
+            return None
+        ctype = r.headers.get("content-type", "")
+        return not ctype or ctype.startswith("image/")
+
+    def check(self, urls):
+        """Return {url: exists} for urls; cached answers are reused, the rest are checked concurrently."""
+        if self.breaker and self.breaker.state != "closed":
+            return {url: True for url in urls}       # shop is down: don't add load, let Woo decide later
+        now, result, todo = self.clock(), {}, []
+        with self._lock:
+            for url in dict.fromkeys(urls):
+                hit = self._seen.get(url)
+                if hit and now - hit[1] < self.ttl:
+                    result[url] = hit[0]
+                else:
+                    todo.append(url)
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(todo))) as pool:
+                answers = list(pool.map(self._head, todo))
+            with self._lock:
+                for url, ok in zip(todo, answers):
+                    if ok is not None:
+                        self._seen[url] = (ok, now)
+                    result[url] = ok is not False
+        return result
+
+    def strip(self, payloads, known=None):
+        """
+        Copies of payloads without the images whose src is missing.
+        known(url) → True skips the check (e.g. URLs already linked by media ID).
+        """
+        urls = [img["src"] for p in payloads for img in p.get("images") or []
+                if img.get("src") and not (known and known(img["src"]))]
+        if not urls:
+            return payloads
+        exists = self.check(urls)
+        out = []
+        for p in payloads:
+            images = p.get("images")
+            if not images:
+                out.append(p)
+                continue
+            kept = [img for img in images if exists.get(img.get("src"), True)]
+            if len(kept) != len(images):
+                print(f"[Images] {p.get('sku')}: {len(images) - len(kept)} missing image(s) dropped")
+                p = {**p, "images": kept}
+            out.append(p)
+        return out
@@ -3,26 +3,233 @@ main.py  –  Orchestrates:  DB  ➜  Transform  ➜  WooCommerce  ➜  DB
 
 Run it with:
     python main.py                # uses .env.dev by default
+    python main.py retry          # replay only the dead-letter queue
 Switch to production by:
     cp .env.prod .env             # or export WOO_CK / WOO_CS vars
 """
 
-import json, os, time, traceback, yaml, pathlib
+import asyncio, json, os, sys, time, traceback, pathlib
 from dotenv import load_dotenv
-from db import DB
-from woo_api import Woo
-from transform import group_rows, build_parent_and_children
+from db import DB, PARENT_KEY_COLS
+from woo_api import Woo, CircuitOpenError
+from transform import concat_style_color, variation_sku, source_columns, upload_filters, start_run
+from sync_engine import SyncEngine, ImageLane, record_variation_results, queue_parent, with_leftovers, skip_dead_letters
+from outbox import Outbox, OutboxEntry
+from dead_letters import open_dead_letters
+from settings import load_settings
 from pathlib import Path
 
-def main():
+def _source_columns(db, col_name, filters):
+    """
+    Columns to project, checked once against the view: optional ones it lacks are
+    dropped (transform.py reads them as empty), missing key/filter columns stop the run.
+    """
+    columns   = source_columns() + [col_name]
+    available = db.table_columns()
+    table     = load_settings().db.table
+    required  = [c for c in [col_name, *PARENT_KEY_COLS, *(filters or {})] if c.lower() not in available]
+    if required:
+        raise RuntimeError(f"Required column(s) missing from {table}: {', '.join(required)}")
+    missing = [c for c in dict.fromkeys(columns) if c.lower() not in available]
+    if missing:
+        print(f"⚠ Columns not in {table}: {', '.join(missing)} – transform.py sees them as empty")
+    return [c for c in columns if c.lower() in available]
+
+
+def _parent_buckets(db, force_barcodes, col_name):
+    """Stream (parent_sku, rows) pairs from the DB, one complete parent at a time."""
+    # brand/season rules run in SQL; force mode bypasses them like transform.py does
+    filters = None if force_barcodes else upload_filters()
+    columns = _source_columns(db, col_name, filters)      # checked before the first row is read
+
+    def _stream():
+        for rows in db.iter_new_buckets(force_barcodes, columns=columns, filters=filters):
+            if force_barcodes:                            # safety net, SQL already filters
+                rows = [r for r in rows
+                        if str(r.get(col_name, "")).strip() in force_barcodes]
+                if not rows:
+                    continue
+            yield concat_style_color(rows[0]), rows
+    return _stream()
+
+
+def _seed_sku_index(db, woo):
+    """Fill woo.skus with the parent / variation IDs the sync table already knows."""
+    for row in db.fetch_synced_skus():
+        if not (row.get("b_Style") and row.get("b_Color")):
+            continue
+        parent_sku = concat_style_color(row)
+        woo.skus.add(parent_sku, row["parent_id"])
+        if row.get("woo_id") and row["woo_id"] != row["parent_id"]:
+            woo.skus.add(variation_sku(parent_sku, row["size"]), row["woo_id"], row["parent_id"])
+    print(f"🔎 SKU index seeded from DB: {len(woo.skus)} SKU(s)")
+
+
+def _sync_batched(db, woo, buckets, outbox, dead_letters, image_lane=False):
+    """
+    Build every ready parent first, create them through products/batch
+    (100 per request), then upload the variations of each created parent.
+    With image_lane the parents go out without images, attached at the end.
+    Every step is recorded in the outbox, leftovers of an earlier run are resumed.
+    """
+    # 4) Build payloads for all buckets (outbox leftovers are refreshed from theirs)
+    ready = []
+    for parent_sku, item in with_leftovers(outbox, buckets):
+        entry = item if isinstance(item, OutboxEntry) else queue_parent(outbox, parent_sku, item, image_lane)
+        if entry and skip_dead_letters(entry, dead_letters):
+            ready.append(entry)
+    print(f"▶ {len(ready)} parent(s) ready for batch upload.\n")
+
+    # 5) POST parents in batches (only those not created by an earlier run)
+    to_create = [e for e in ready if not e.parent_id]
+    for entry, p_resp in zip(to_create, woo.post_products_batch([e.parent_json for e in to_create])):
+        if not p_resp.get("id") or "error" in p_resp:
+            err = p_resp.get("error", p_resp)
+            msg = err.get("message", json.dumps(err))
+            print(f"✗ Parent {entry.parent_sku} failed: {msg}\n")
+            dead_letters.add("parent", entry.parent_sku, "products", entry.parent_json, p_resp)
+            continue
+        entry.parent_id = p_resp["id"]
+        outbox.parent_created(entry.parent_sku, entry.parent_id)
+        dead_letters.resolve("parent", [entry.parent_sku])
+    image_jobs = []
+
+    # 6) POST variations of every parent that made it
+    for entry in ready:
+        if not entry.parent_id:
+            continue
+        parent_sku, parent_id = entry.parent_sku, entry.parent_id
+        woo.skus.add(parent_sku, parent_id)
+        print(f"✔ Parent uploaded: {parent_sku} → Woo ID {parent_id}")
+        if entry.variations:
+            results = woo.post_variations_batch(parent_id, entry.variations)
+            marks = record_variation_results(db, parent_id, results, dead_letters, parent_sku)
+            outbox.variations_done(parent_sku, marks)
+        print("")  # blank line between parents
+        if entry.images:
+            image_jobs.append((parent_id, parent_sku, entry.images))
+        else:
+            outbox.finish(parent_sku)
+
+    # 7) Attach images now that every product is live
+    if image_jobs:
+        asyncio.run(ImageLane(woo, on_done=outbox.images_done).drain(image_jobs))
+
+
+def _replay(db, woo, outbox, dead_letters, item):
+    """Send one dead letter again; success clears it, failure re-queues it with a longer backoff."""
+    if item.kind == "parent":
+        entry = outbox.get(item.key) or OutboxEntry(item.key, item.payload)
+        if not entry.parent_id:
+            resp = woo.post_product(entry.parent_json)
+            if not resp.get("id"):
+                dead_letters.add(item.kind, item.key, item.endpoint, entry.parent_json, resp)
+                return False
+            entry.parent_id = resp["id"]
+            outbox.parent_created(item.key, entry.parent_id)
+        dead_letters.resolve(item.kind, [item.key])
+        print(f"✔ Parent uploaded: {item.key} → Woo ID {entry.parent_id}")
+        if entry.variations:                      # the variations the failed parent never got to send
+            results = woo.post_variations_batch(entry.parent_id, entry.variations)
+            outbox.variations_done(item.key, record_variation_results(db, entry.parent_id, results, dead_letters, item.key))
+        if entry.images and woo.attach_images(entry.parent_id, entry.images, item.key).get("id"):
+            outbox.images_done(item.key)
+        outbox.finish(item.key)
+        return True
+
+    if item.kind == "variation":
+        parent_id, parent_sku = item.meta["parent_id"], item.meta.get("parent_sku")
+        results = woo.post_variations_batch(parent_id, [(item.payload, int(item.key))])
+        marks = record_variation_results(db, parent_id, results, dead_letters, parent_sku)
+        if parent_sku:
+            outbox.variations_done(parent_sku, marks)
+            outbox.finish(parent_sku)
+        return bool(marks)
+
+    # "update" – a price/stock push of product_updater.py
+    resp = woo.update_batch(item.endpoint, [item.payload])[0]
+    if resp.get("id") and "error" not in resp:
+        db.touch_updated_many([(int(item.key), item.meta.get("pushed_hash"))])
+        dead_letters.resolve(item.kind, [item.key])
+        print(f"✔ Woo variation ID {item.payload.get('id')}: new price={item.payload.get('regular_price')} "
+              f"new stock={item.payload.get('stock_quantity')}")
+        return True
+    dead_letters.add(item.kind, item.key, item.endpoint, item.payload, resp, item.meta)
+    return False
+
+
+def retry(reset=False, key=None):
+    """
+    `python main.py retry`: replay only the dead letters, waiting out each item's backoff.
+    `retry --reset [key]` first gives the items that were given up (or only `key`) new attempts.
+    """
+    _load_env()
+    settings = load_settings()
+    dead_letters = open_dead_letters(settings.dead_letters)
+    if reset:
+        print(f"↺ Reset {dead_letters.reset(key)} given-up item(s)")
+    print(f"🔁 Retrying dead letters: {len(dead_letters)} item(s) queued")
+    if not len(dead_letters):
+        return
+    start_run()
+    db  = DB()
+    woo = Woo(debug=False)
+    outbox = Outbox(settings.outbox.path)
+    _seed_sku_index(db, woo)
+
+    ok = failed = 0
+    tried = {}                                  # (kind, key) -> attempts when it was last replayed
+    try:
+        while True:
+            due = dead_letters.due()
+            items = [i for i in due if tried.get((i.kind, i.key)) != i.attempts]
+            if due and not items:               # replayed but not re-queued: never send it twice in a row
+                print(f"⚠ {len(due)} item(s) were not re-queued after their replay – stopping")
+                break
+            if not items:
+                next_at = dead_letters.next_due()
+                if next_at is None:
+                    break
+                wait = max(0.0, next_at - time.time())
+                print(f"⏳ Next retry in {wait:.0f}s")
+                time.sleep(wait)
+                continue
+            for item in items:
+                tried[item.kind, item.key] = item.attempts
+                print(f"↻ {item.kind} {item.key} (attempt {item.attempts + 1}, last error: {item.error_code})")
+                try:
+                    done = _replay(db, woo, outbox, dead_letters, item)
+                except CircuitOpenError:
+                    print(f"⏸ Woo unreachable – retry paused, {len(dead_letters)} item(s) still queued")
+                    return
+                except Exception as ex:
+                    dead_letters.add(item.kind, item.key, item.endpoint, item.payload, ex, item.meta)
+                    done = False
+                if done:
+                    ok += 1
+                else:
+                    failed += 1
+    finally:
+        woo.media.save()
+
+    for kind, key, code, message in dead_letters.exhausted():
+        print(f"✗ Gave up on {kind} {key}: {code} {message}")
+    print(f"✅ Retry complete: {ok} succeeded, {failed} failed attempt(s), {len(dead_letters)} still queued.")
+
+
+def _load_env():
     env_file = ".env.dev" if os.path.exists(".env.dev") else ".env"
     load_dotenv(env_file)
     print(f"Loaded secrets from {env_file}")
-    
+
+
+def main():
+    _load_env()
 
     # ------- Read optional barcode list ------------------------------
-    cfg = yaml.safe_load(pathlib.Path("config.yaml").read_text(encoding="utf-8"))
-    col_name = cfg.get("barcode_column", "b_Barcode")
+    settings = load_settings()
+    cfg = settings.raw
+    col_name = settings.barcode_col
 
     # Gather barcodes from config and file, stripping ALL whitespace
     barcodes_cfg = {str(b).strip() for b in cfg.get("force_barcodes", [])}
@@ -45,56 +252,43 @@ def main():
 
     # 1) Initialization
     print("🔄 Starting sync…")
+    calendar = start_run()                        # season codes fixed for the whole run
+    print(f"📅 Seasons as of {calendar.as_of}: current {calendar.current}, recent {sorted(calendar.recent)}")
     db  = DB()
     woo = Woo(debug=False)
+    outbox = Outbox(settings.outbox.path)         # resumes whatever an interrupted run left behind
+    dead_letters = open_dead_letters(settings.dead_letters)
 
-    # 2) Fetch rows needing upload
-    rows = db.fetch_new_rows(FORCE_BARCODES)
-    if FORCE_BARCODES:                            
-        rows = [r for r in rows
-                if str(r.get(col_name, "")).strip() in FORCE_BARCODES]
-        
-    print(f"▶ Found {len(rows)} rows to sync.\n")
-
-    # 3) Group rows by parent (style+color)
-    buckets = group_rows(rows)
-    for parent_sku, bucket in buckets.items():
-        print(f"--- Syncing parent {parent_sku} ---")
-
-        # 4) Build payloads
-        parent_json, variations = build_parent_and_children(bucket)
-        if not parent_json:
-            print(f"⚠ Skipped {parent_sku} (filtered out)\n")
-            continue
+    # 2) Stream rows needing upload, already grouped by parent (style+color)
+    buckets = _parent_buckets(db, FORCE_BARCODES, col_name)
 
-        # 5) POST parent
-        p_resp = woo.post_product(parent_json)  
-        if "id" not in p_resp:
-            msg = p_resp.get("message", json.dumps(p_resp))
-            print(f"✗ Parent {parent_sku} failed: {msg}\n")
-            continue
-        parent_id = p_resp["id"]
-        print(f"✔ Parent uploaded: {parent_sku} → Woo ID {parent_id}")
-
-        # 6) POST each variation
-        for var, row_id in variations:
-            var_sku = var["sku"]
-            v_resp = woo.post_variation(parent_id, var)
-            if "id" in v_resp:
-                var_id = v_resp["id"]
-                print(f"   ✔ Variation uploaded: {var_sku} → Woo ID {var_id}")
-                db.mark_uploaded(product_ref_id=row_id, parent_id=parent_id, external_id=var_id)
-            else:
-                msg = v_resp.get("message", json.dumps(v_resp))
-                print(f"   ✗ Variation {var_sku} failed: {msg}")
-        time.sleep(1)
-        print("")  # blank line between parents
+    try:
+        _seed_sku_index(db, woo)
+        if FORCE_BARCODES or settings.woo_api.prefetch_skus:
+            woo.prefetch_skus()                   # re-uploads: most SKUs already exist on Woo
+        if settings.woo_api.batch_parents:
+            _sync_batched(db, woo, buckets, outbox, dead_letters, image_lane=settings.images.async_lane)
+        else:
+            SyncEngine(db, woo, outbox=outbox, dead_letters=dead_letters).run(buckets)
+    except CircuitOpenError:
+        print(f"⏸ Woo unreachable – run paused, {len(outbox)} parent(s) pending in the outbox; the next run resumes them")
+        return
+    finally:
+        woo.media.save()                          # keep the media IDs learnt so far
 
+    if len(dead_letters):
+        print(f"⚠ {len(dead_letters)} failed item(s) in the dead-letter queue – run `python main.py retry`")
     print("✅ Sync complete.")
 
 if __name__ == "__main__":
     try:
-        main()
+        if sys.argv[1:2] == ["retry"]:
+            args = sys.argv[2:]
+            reset = "--reset" in args
+            keys = [a for a in args if a != "--reset"]
+            retry(reset, keys[0] if keys else None)
+        else:
+            main()
     except Exception as ex:
         print("[FATAL] Unhandled error in main():")
         import traceback
@@ -0,0 +1,69 @@
+# media_cache.py  – image URL ➜ WordPress media ID, kept between runs
+# -------------------------------------------------
+#  • Woo sideloads every {"src": url} again: new attachment, new thumbnails.
+#  • Once a create/update answer told us the attachment ID of a URL, later
+#    payloads send {"id": media_id} instead and WordPress just links it.
+#  • Stored as JSON next to config.yaml (images.media_cache_file, "" = off).
+# -------------------------------------------------
+import json, os, pathlib, threading
+
+
+class MediaCache:
+    """Thread-safe {image_url: media_id} map, loaded once and saved with save()."""
+
+    def __init__(self, path: str | os.PathLike | None):
+        self.path   = pathlib.Path(path) if path else None
+        self._ids   = {}
+        self._dirty = False
+        self._lock  = threading.Lock()
+        if self.path and self.path.exists():
+            try:
+                self._ids = {str(k): int(v) for k, v in json.loads(self.path.read_text(encoding="utf-8")).items()}
+            except (ValueError, OSError) as ex:
+                print(f"[Media] Warning: ignoring unreadable {self.path}: {ex}")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, url):
+        return bool(self.path) and url in self._ids
+
+    def swap(self, images):
+        """Copy of a Woo "images" list with every known {"src": url} replaced by {"id": media_id}."""
+        out = []
+        with self._lock:
+            for img in images or []:
+                media_id = self._ids.get(img.get("src")) if self.path else None
+                out.append({"id": media_id} if media_id else img)
+        return out
+
+    def learn(self, sent, answered):
+        """Remember url → id from the images we sent and the images Woo answered (same order)."""
+        if not self.path or not isinstance(answered, list):
+            return
+        with self._lock:
+            for img, got in zip(sent or [], answered):
+                url = img.get("src")
+                if url and isinstance(got, dict) and got.get("id") and self._ids.get(url) != got["id"]:
+                    self._ids[url] = int(got["id"])
+                    self._dirty = True
+
+    def forget(self, images):
+        """Drop the URLs of an images list, e.g. when their attachment was deleted from the media library."""
+        with self._lock:
+            for img in images or []:
+                if self._ids.pop(img.get("src"), None) is not None:
+                    self._dirty = True
+
+    def save(self):
+        """Write the map back (atomically) if anything changed."""
+        if not self.path or not self._dirty:
+            return
+        with self._lock:
+            data, self._dirty = dict(self._ids), False
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp.write_text(json.dumps(data, indent=0, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as ex:
+            print(f"[Media] Warning: could not save {self.path}: {ex}")
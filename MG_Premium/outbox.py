@@ -0,0 +1,155 @@
+# outbox.py  – durable per-parent upload state (SQLite)
+# -------------------------------------------------
+#  • Every transformed parent is written here before it is sent:
+#    parent payload, variation payloads (with their DB row ids) and,
+#    in image-lane mode, the images still to attach.
+#  • Each finished step is recorded: parent created with Woo ID X,
+#    variation row N uploaded as Woo ID Y, images attached. A parent
+#    leaves the outbox only when all its steps are done.
+#  • After a crash the next run drains the leftovers first and resumes
+#    at the missing step – no parent re-POST, no SKU-conflict lookups.
+#    Parents Woo never created are rebuilt from the DB instead.
+#  • outbox.path "" keeps the same bookkeeping in memory (not durable).
+# -------------------------------------------------
+import json, sqlite3, threading, time
+from dataclasses import dataclass, field
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    parent_sku  TEXT PRIMARY KEY,
+    parent_json TEXT NOT NULL,
+    parent_id   INTEGER,
+    images      TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox_variations (
+    parent_sku  TEXT NOT NULL,
+    row_id      INTEGER NOT NULL,
+    position    INTEGER NOT NULL,
+    payload     TEXT NOT NULL,
+    woo_id      INTEGER,
+    PRIMARY KEY (parent_sku, row_id)
+);
+"""
+
+
+@dataclass
+class OutboxEntry:
+    """One parent and the steps it still needs."""
+    parent_sku: str
+    parent_json: dict
+    parent_id: int | None = None
+    variations: list = field(default_factory=list)    # [(payload, row_id), ...] not uploaded yet
+    images: list | None = None                         # still to attach (image lane), None = nothing
+
+
+class Outbox:
+    """SQLite outbox shared by the sync threads; every write is its own small transaction."""
+
+    def __init__(self, path: str | None = None):
+        self.path  = path or ":memory:"
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _tx(self, statements):
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    cur.executemany(sql, params) if isinstance(params, list) else cur.execute(sql, params)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def put(self, parent_sku, parent_json, variations, images=None) -> OutboxEntry:
+        """
+        Store (or refresh) the payloads of one parent. Steps already done are kept:
+        a known parent_id stays, uploaded variations are not re-queued.
+        """
+        now = time.time()
+        self._tx([
+            ("INSERT INTO outbox (parent_sku, parent_json, images, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+             "ON CONFLICT(parent_sku) DO UPDATE SET parent_json = excluded.parent_json, "
+             "images = excluded.images, updated_at = excluded.updated_at",
+             (parent_sku, json.dumps(parent_json), json.dumps(images) if images else None, now, now)),
+            ("INSERT INTO outbox_variations (parent_sku, row_id, position, payload) VALUES (?, ?, ?, ?) "
+             "ON CONFLICT(parent_sku, row_id) DO UPDATE SET position = excluded.position, payload = excluded.payload "
+             "WHERE woo_id IS NULL",
+             [(parent_sku, row_id, pos, json.dumps(var)) for pos, (var, row_id) in enumerate(variations)]),
+        ])
+        return self.get(parent_sku)
+
+    def get(self, parent_sku) -> OutboxEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT parent_json, parent_id, images FROM outbox WHERE parent_sku = ?", (parent_sku,)).fetchone()
+            if row is None:
+                return None
+            variations = self._conn.execute(
+                "SELECT payload, row_id FROM outbox_variations WHERE parent_sku = ? AND woo_id IS NULL "
+                "ORDER BY position", (parent_sku,)).fetchall()
+        return OutboxEntry(
+            parent_sku  = parent_sku,
+            parent_json = json.loads(row[0]),
+            parent_id   = row[1],
+            variations  = [(json.loads(p), row_id) for p, row_id in variations],
+            images      = json.loads(row[2]) if row[2] else None,
+        )
+
+    def pending(self) -> list[OutboxEntry]:
+        """Every parent left over from an earlier run, oldest first (see also resumable())."""
+        with self._lock:
+            skus = [r[0] for r in self._conn.execute("SELECT parent_sku FROM outbox ORDER BY created_at")]
+        return [e for e in map(self.get, skus) if e]
+
+    def resumable(self) -> list[OutboxEntry]:
+        """
+        Leftovers with recorded progress (parent created on Woo). Entries that never got
+        that far are dropped: their rows are still unmarked in the DB, so the next stream
+        rebuilds them from fresh data instead of re-sending a payload Woo already refused.
+        """
+        entries = []
+        for entry in self.pending():
+            if entry.parent_id:
+                entries.append(entry)
+            else:
+                self.discard(entry.parent_sku)
+        return entries
+
+    def parent_created(self, parent_sku, parent_id):
+        self._tx([("UPDATE outbox SET parent_id = ?, updated_at = ? WHERE parent_sku = ?",
+                   (parent_id, time.time(), parent_sku))])
+
+    def variations_done(self, parent_sku, marks):
+        """marks: [(row_id, parent_id, woo_id), ...] as given to DB.mark_uploaded_many()."""
+        if marks:
+            self._tx([("UPDATE outbox_variations SET woo_id = ? WHERE parent_sku = ? AND row_id = ?",
+                       [(woo_id, parent_sku, row_id) for row_id, _, woo_id in marks])])
+
+    def discard(self, parent_sku):
+        """Forget a parent completely (its payload will be rebuilt from the DB)."""
+        self._tx([("DELETE FROM outbox_variations WHERE parent_sku = ?", (parent_sku,)),
+                  ("DELETE FROM outbox WHERE parent_sku = ?", (parent_sku,))])
+
+    def images_done(self, parent_sku):
+        self._tx([("UPDATE outbox SET images = NULL, updated_at = ? WHERE parent_sku = ?",
+                   (time.time(), parent_sku))])
+        self.finish(parent_sku)
+
+    def finish(self, parent_sku) -> bool:
+        """Drop the parent if every step is done; returns True when it was removed."""
+        entry = self.get(parent_sku)
+        if entry is None or not entry.parent_id or entry.variations or entry.images:
+            return False
+        self.discard(parent_sku)
+        return True
@@ -30,7 +30,7 @@
 #  Note: The **main product table is never modified** unless a future flag is added.
 # ------------------------------------------------------------------------------
 from __future__ import annotations
-import argparse, pathlib, sys, yaml, datetime, shutil
+import argparse, pathlib, sys, datetime, shutil
 from collections import defaultdict
 from typing import Iterable, List, Set
 from dotenv import load_dotenv
@@ -44,7 +44,8 @@ from db import (
     SYNC_PARENT_COL,
     BARCODE_COL,
 )
-from woo_api import Woo
+from woo_api import Woo, CircuitOpenError
+from settings import load_settings
 
 # ================================= helper ======================================
 
@@ -122,11 +123,18 @@ def process_barcodes(*, barcodes: Set[str], flag_col: str, purge_db: bool, keep_
         by_parent[r["parent_id"]].append(r)
 
     ok = fail = 0
+    done_rows: list[dict] = []
+    paused = False
     for parent_id, children in by_parent.items():
+        if paused:
+            break
         parent_json = None
         if parent_id and not keep_images:
             try:
                 parent_json = woo.wc.get(f"products/{parent_id}").json()
+            except CircuitOpenError:
+                paused = True
+                break
             except Exception:
                 parent_json = None
         for row in children:
@@ -139,6 +147,9 @@ def process_barcodes(*, barcodes: Set[str], flag_col: str, purge_db: bool, keep_
                 try:
                     prod_json = woo.wc.get(endpoint).json()
                     image_ids.extend(_collect_image_ids(prod_json))
+                except CircuitOpenError:
+                    paused = True
+                    break
                 except Exception:
                     pass
             try:
@@ -149,11 +160,15 @@ def process_barcodes(*, barcodes: Set[str], flag_col: str, purge_db: bool, keep_
                         _delete_media_ids(woo, image_ids)
                 else:
                     fail += 1
+            except CircuitOpenError:
+                paused = True
+                break
             except Exception as ex:
                 print(f"✗ {row['barcode']}: {ex}")
                 fail += 1
+            done_rows.append(row)
         # delete parent
-        if parent_id and all(r["woo_id"] for r in children):
+        if parent_id and not paused and all(r["woo_id"] for r in children):
             parent_imgs = _collect_image_ids(parent_json) if (parent_json and not keep_images) else []
             try:
                 woo.wc.delete(f"products/{parent_id}", params={"force": True})
@@ -163,6 +178,15 @@ def process_barcodes(*, barcodes: Set[str], flag_col: str, purge_db: bool, keep_
                 print(f"! Could not delete parent {parent_id}: {ex}")
 
     # ---- update or purge sync table ----------------------------------------------
+    if paused:
+        # Woo is down: only the rows handled so far are reset; the list is kept so the
+        # same command finishes the rest (reset rows have no woo_id and are skipped)
+        pending = [r["barcode"] for r in rows if r["woo_id"] and r not in done_rows]
+        print(f"⏸ Woo unreachable – paused with {len(pending)} item(s) pending: {', '.join(pending[:10])}"
+              f"{'…' if len(pending) > 10 else ''}")
+        rows, rename_file = done_rows, None
+        if not rows:
+            return
     ref_ids = [r["ref_id"] for r in rows]
     ph_ids  = ", ".join(["?"] * len(ref_ids))
     cur = db.conn.cursor()
@@ -210,7 +234,7 @@ if __name__ == "__main__":
     if not cfg_path.exists():
         print("[ERROR] config.yaml not found.")
         sys.exit(1)
-    cfg = yaml.safe_load(cfg_path.read_text(encoding="utf-8"))
+    cfg = load_settings(cfg_path).raw
 
     default_file = cfg.get("delete_barcodes_file", "delete_barcodes.txt")
     flag_col     = cfg.get("uploaded_past_col", "uploaded_past")
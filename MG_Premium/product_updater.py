@@ -1,17 +1,47 @@
-import os, yaml, pathlib
+import os, hashlib, json, pathlib, datetime
+from collections import defaultdict
 from dotenv import load_dotenv
 from db import DB
-from woo_api import Woo
+from woo_api import Woo, CircuitOpenError
+from settings import load_settings
+from dead_letters import open_dead_letters
 
 # ----- config that we need only once -----
-_cfg = yaml.safe_load(pathlib.Path("config.yaml").read_text(encoding="utf-8"))
-STOCK_COLUMNS = _cfg.get("stock_columns", [])
+settings = load_settings()
+STOCK_COLUMNS = list(settings.stock_columns)
 
-# ----- NEW: guard against None -----
-STYLE_COL = (_cfg.get("updater", {}).get("style_col") or "").strip()
-SIZE_COL  = (_cfg.get("updater", {}).get("size_col")  or "").strip()
+# ----- empty style_col turns J_Style aggregation off -----
+STYLE_COL = settings.updater.style_col
+SIZE_COL  = settings.updater.size_col
 USE_STYLE = bool(STYLE_COL)  
 
+# ----- incremental mode: only rows changed since the last successful run -----
+INCREMENTAL    = settings.updater.incremental
+WATERMARK_FILE = pathlib.Path(settings.updater.watermark_file)
+CHANGE_SOURCE  = settings.updater.change_source
+
+def payload_fingerprint(payload: dict) -> str:
+    """Short hash of the values we push, stored in the sync table to skip no-op updates."""
+    raw = f"{payload['regular_price']}|{payload['stock_quantity']}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def load_watermark() -> int | None:
+    """Change marker of the last successful run (None = first run / other change source → full scan)."""
+    try:
+        data = json.loads(WATERMARK_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return data.get("marker") if data.get("source") == CHANGE_SOURCE else None
+
+def save_watermark(marker: int) -> None:
+    tmp = WATERMARK_FILE.with_name(WATERMARK_FILE.name + ".tmp")
+    tmp.write_text(json.dumps({
+        "source": CHANGE_SOURCE,
+        "marker": marker,
+        "saved_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }), encoding="utf-8")
+    os.replace(tmp, WATERMARK_FILE)
+
 def main() -> None:
     env_file = ".env.dev" if os.path.exists(".env.dev") else ".env"
     load_dotenv(env_file)
@@ -19,8 +49,14 @@ def main() -> None:
 
     db  = DB()
     woo = Woo(debug=False)
+    dead_letters = open_dead_letters(settings.dead_letters)
 
-    products = db.fetch_products_for_update()
+    since = marker = None
+    if INCREMENTAL:
+        marker = db.change_marker()                       # read first: changes after this go to the next run
+        since  = load_watermark()
+        print(f"Incremental mode: changes since {since if since is not None else 'ever (full scan)'}")
+    products = db.fetch_products_for_update(since=since)
     print(f"Found {len(products)} products to update.")
 
     # 1) Duplicate detection only when we really care about J_Style
@@ -30,9 +66,15 @@ def main() -> None:
             key = (r.get("j_style"), r.get("size"))
             dup_count[key] = dup_count.get(key, 0) + 1
 
-    combined_cache = {}
-    updated = failed = 0
+    # all (style,size) stock totals in one grouped query, only if some key repeats
+    combined = {}
+    if any(key[0] and n > 1 for key, n in dup_count.items()):
+        styles = {key[0] for key, n in dup_count.items() if key[0] and n > 1} if since is not None else None
+        combined = db.fetch_jstyle_stock_totals(styles)
+    updated = failed = unchanged = 0
 
+    # 2) Compute every payload, grouped by parent (None = simple product)
+    groups = defaultdict(list)
     for row in products:
         woo_id  = row["woo_id"]
         price   = row["price"]
@@ -41,10 +83,8 @@ def main() -> None:
             key = (row.get("j_style"), row.get("size"))
             # aggregate only if this (style,size) appears >1 times **and**
             # the style field is non-empty
-            if key[0] and dup_count.get(key, 0) > 1:
-                if key not in combined_cache:
-                    combined_cache[key] = db.sum_stock_for_jstyle_size(*key)
-                total_stock = combined_cache[key]
+            if key[0] and dup_count.get(key, 0) > 1 and key in combined:
+                total_stock = combined[key]
             else:
                 total_stock = sum(int(row.get(c) or 0) for c in STOCK_COLUMNS)
         else:
@@ -52,30 +92,55 @@ def main() -> None:
             total_stock = sum(int(row.get(c) or 0) for c in STOCK_COLUMNS)
 
         payload = {
+            "id"           : woo_id,
             "regular_price": str(price) if price is not None else "",
             "manage_stock" : True,
             "stock_quantity": total_stock
         }
+        fingerprint = payload_fingerprint(payload)
+        if fingerprint == row.get("pushed_hash"):
+            unchanged += 1                                # same as last push → nothing to send
+            continue
+        groups[row.get("parent_id") or None].append((row, payload, fingerprint))
 
+    # 3) One batched update per parent, simple products through products/batch
+    pending = 0
+    for n, (parent_id, items) in enumerate(groups.items()):
+        endpoint = f"products/{parent_id}/variations" if parent_id else "products"
         try:
-            parent_id = row.get("parent_id")
-            if parent_id:                                 # variation
-                endpoint = f"products/{parent_id}/variations/{woo_id}"
-            else:                                         # simple product
-                endpoint = f"products/{woo_id}"
-            resp = woo.wc.put(endpoint, payload).json()
-            if "id" in resp:
+            results = woo.update_batch(endpoint, [payload for _, payload, _ in items])
+        except CircuitOpenError:
+            # shop is down: stop here; rows not stamped keep their old fingerprint → next run sends them
+            pending = sum(len(rest) for rest in list(groups.values())[n:])
+            break
+        except Exception as ex:
+            failed += len(items)
+            print(f"✗ Exception for {endpoint}/batch ({len(items)} items): {ex}")
+            for row, payload, fingerprint in items:
+                dead_letters.add("update", row["id"], endpoint, payload, ex, meta={"pushed_hash": fingerprint})
+            continue
+
+        touched = []
+        for (row, payload, fingerprint), resp in zip(items, results):
+            woo_id = payload["id"]
+            if resp.get("id") and "error" not in resp:
                 updated += 1
-                db.touch_updated(row["id"])
-                print(f"✔ Woo variation ID {woo_id}: new price={payload['regular_price']} new stock={total_stock}")
+                touched.append((row["id"], fingerprint))
+                print(f"✔ Woo variation ID {woo_id}: new price={payload['regular_price']} new stock={payload['stock_quantity']}")
             else:
                 failed += 1
-                print(f"✗ Woo variation ID {woo_id} failed: {resp}")
-        except Exception as ex:
-            failed += 1
-            print(f"✗ Exception for Woo variation ID {woo_id}: {ex}")
+                print(f"✗ Woo variation ID {woo_id} failed: {resp.get('error', resp)}")
+                dead_letters.add("update", row["id"], endpoint, payload, resp, meta={"pushed_hash": fingerprint})
+        db.touch_updated_many(touched)
+        dead_letters.resolve("update", [ref for ref, _ in touched])
 
-    print(f"Done: {updated} updated, {failed} failed.")
+    if pending:
+        print(f"⏸ Woo unreachable – run paused, {pending} update(s) pending for the next run.")
+    elif INCREMENTAL:
+        save_watermark(marker)                            # failures are in the dead-letter queue
+    print(f"Done: {updated} updated, {unchanged} unchanged, {failed} failed.")
+    if failed:
+        print("Failed items are in the dead-letter queue – run `python main.py retry`")
 
 if __name__ == "__main__":
     main()
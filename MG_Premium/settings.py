@@ -0,0 +1,232 @@
+# settings.py  – config.yaml parsed once, with typed sections on top
+# -------------------------------------------------
+#  • Uses libyaml's CSafeLoader when PyYAML was built with it.
+#  • The parsed YAML is stored as JSON in .config.cache, keyed by
+#    config.yaml's mtime and size, so short cron runs skip YAML; the typed
+#    sections are always rebuilt (and validated) from it.
+#  • Unknown keys in a typed section are a ConfigError, so typos don't
+#    silently fall back to the default.
+#  • Every script reads `settings = load_settings()`; the raw dict is still
+#    available as settings.raw for sections without a typed view.
+# -------------------------------------------------
+from __future__ import annotations
+import json, os, pathlib
+from dataclasses import dataclass, field
+import yaml
+
+try:
+    _Loader = yaml.CSafeLoader
+except AttributeError:              # PyYAML without libyaml
+    _Loader = yaml.SafeLoader
+
+CONFIG_PATH = pathlib.Path(os.getenv("MG_CONFIG", "config.yaml"))
+CACHE_PATH  = CONFIG_PATH.with_name(".config.cache")
+_CACHE_FORMAT = 2                   # 1 = the old pickle cache
+
+
+class ConfigError(ValueError):
+    """config.yaml is missing a required key or has a wrong value."""
+
+
+@dataclass(frozen=True)
+class DBSettings:
+    table: str
+    id_col: str
+    sync_table: str
+    sync_product_ref_col: str
+    sync_uploaded_col: str
+    sync_external_id_col: str
+    sync_parent_id_col: str
+    sync_uploaded_date_col: str
+    sync_updated_date_col: str
+    sync_pushed_hash_col: str = ""          # empty = push every row
+    product_name_seo: str = ""              # SEO name column, not read by the sync
+    barcode_col: str = "Barcode"
+    fetch_chunk_size: int = 500
+    extra_columns: tuple = ()
+
+
+@dataclass(frozen=True)
+class WooApiSettings:
+    version: str = "wc/v3"
+    timeout: float = 20
+    connect_timeout: float = 5
+    pool_size: int = 10
+    http2: bool = False
+    verify_ssl: bool = True
+    batch_size: int = 100
+    batch_parents: bool = False
+    concurrency: int = 4
+    rate_limit: float = 5
+    rate_burst: int | None = None
+    prefetch_skus: bool = False
+    adaptive: bool = True
+    min_rate: float = 0.5
+    max_rate: float = 20
+    target_latency: float = 2.0
+    retries: int = 3
+    retry_backoff: float = 1.0
+    breaker_threshold: int = 5
+    breaker_reset: float = 30
+
+
+@dataclass(frozen=True)
+class ImagesSettings:
+    base_url: str
+    columns: tuple = ()
+    file_ext: str = ".jpg"
+    skip_empty: bool = True
+    media_cache_file: str = ".media_cache.json"     # image URL → media ID, "" = off
+    preflight: bool = True                          # HEAD-check image URLs before upload
+    preflight_ttl: float = 3600
+    preflight_workers: int = 8
+    async_lane: bool = False                        # create products first, attach images afterwards
+    lane_concurrency: int = 2
+    lane_retries: int = 3
+
+
+@dataclass(frozen=True)
+class OutboxSettings:
+    path: str = ".outbox.sqlite"            # empty = in memory only (no resume)
+
+
+@dataclass(frozen=True)
+class DeadLettersSettings:
+    path: str = ".dead_letters.sqlite"      # empty = in memory only (no retry command)
+    backoff_base: float = 30
+    max_attempts: int = 5
+
+
+@dataclass(frozen=True)
+class UpdaterSettings:
+    style_col: str = ""                     # empty = no J_Style aggregation
+    size_col: str = "b_Size"
+    incremental: bool = False               # only rows changed since the last run
+    change_source: str = "rowversion"       # rowversion | change_tracking
+    rowversion_cols: tuple = ()             # rowversion columns exposed by db.table
+    change_tables: tuple = ()               # base tables with change tracking enabled
+    change_key_col: str = ""                # key column of those tables ...
+    change_match_col: str = ""              # ... matched against this db.table column (default db.id_col)
+    watermark_file: str = ".updater_watermark.json"
+
+
+@dataclass(frozen=True)
+class Settings:
+    raw: dict
+    db: DBSettings
+    woo_api: WooApiSettings
+    images: ImagesSettings
+    updater: UpdaterSettings
+    outbox: OutboxSettings
+    dead_letters: DeadLettersSettings
+    stock_columns: tuple = ()
+    barcode_col: str = "Barcode"            # one name for db.barcode_col / barcode_column
+    source: tuple = field(default=(), compare=False)   # (mtime_ns, size) of the parsed file
+
+
+def _section(raw: dict, name: str, cls, required: bool = True):
+    """Build one typed section; unknown or missing required keys raise ConfigError."""
+    data = raw.get(name)
+    if data is None:
+        if required:
+            raise ConfigError(f"config.yaml: section '{name}' is missing")
+        data = {}
+    if not isinstance(data, dict):
+        raise ConfigError(f"config.yaml: section '{name}' must be a mapping")
+
+    known = cls.__dataclass_fields__
+    unknown = sorted(set(data) - set(known))
+    if unknown:
+        raise ConfigError(f"config.yaml: unknown key(s) in '{name}': {', '.join(map(str, unknown))}")
+    kwargs = {}
+    for key, f in known.items():
+        if key not in data or data[key] is None:
+            continue
+        val = data[key]
+        if f.type == "tuple":
+            val = tuple(val or ())
+        elif f.type == "int":
+            val = int(val)
+        elif f.type == "float":
+            val = float(val)
+        elif f.type == "bool":
+            if not isinstance(val, bool):       # "false" / 0 would silently become True / False
+                raise ConfigError(f"config.yaml: {name}.{key} must be true or false, got {val!r}")
+        elif f.type == "str":
+            val = str(val).strip()
+        kwargs[key] = val
+    try:
+        return cls(**kwargs)
+    except TypeError as ex:                 # a required field without default
+        raise ConfigError(f"config.yaml: section '{name}': {ex}") from None
+
+
+def _build(raw: dict, source: tuple) -> Settings:
+    db = _section(raw, "db", DBSettings)
+    barcode = db.barcode_col if "barcode_col" in (raw.get("db") or {}) else \
+        str(raw.get("barcode_column") or db.barcode_col).strip()
+    if barcode != db.barcode_col:
+        db = DBSettings(**{**db.__dict__, "barcode_col": barcode})
+
+    woo = _section(raw, "woo_api", WooApiSettings, required=False)
+    if not 1 <= woo.batch_size <= 100:
+        raise ConfigError("config.yaml: woo_api.batch_size must be between 1 and 100")
+    if woo.concurrency < 1:
+        raise ConfigError("config.yaml: woo_api.concurrency must be at least 1")
+    if not 0 < woo.min_rate <= woo.max_rate:
+        raise ConfigError("config.yaml: woo_api.min_rate must be > 0 and <= max_rate")
+
+    updater = _section(raw, "updater", UpdaterSettings, required=False)
+    if updater.incremental:
+        if updater.change_source == "rowversion" and not updater.rowversion_cols:
+            raise ConfigError("config.yaml: updater.incremental with rowversion needs updater.rowversion_cols")
+        if updater.change_source == "change_tracking" and not (updater.change_tables and updater.change_key_col):
+            raise ConfigError("config.yaml: updater.incremental with change_tracking needs "
+                              "updater.change_tables and updater.change_key_col")
+        if updater.change_source not in ("rowversion", "change_tracking"):
+            raise ConfigError("config.yaml: updater.change_source must be 'rowversion' or 'change_tracking'")
+
+    return Settings(
+        raw           = raw,
+        db            = db,
+        woo_api       = woo,
+        images        = _section(raw, "images", ImagesSettings),
+        updater       = updater,
+        outbox        = _section(raw, "outbox", OutboxSettings, required=False),
+        dead_letters  = _section(raw, "dead_letters", DeadLettersSettings, required=False),
+        stock_columns = tuple(raw.get("stock_columns") or ()),
+        barcode_col   = barcode,
+        source        = source,
+    )
+
+
+_loaded: dict[pathlib.Path, Settings] = {}
+
+def load_settings(path: pathlib.Path | None = None) -> Settings:
+    """
+    Return the process-wide Settings. Re-parsed only when config.yaml's mtime/size
+    changed; otherwise served from memory or rebuilt from the JSON in .config.cache.
+    """
+    path = pathlib.Path(path or CONFIG_PATH).resolve()
+    st = path.stat()
+    source = (st.st_mtime_ns, st.st_size)
+    if path in _loaded and _loaded[path].source == source:
+        return _loaded[path]
+
+    cache = path.with_name(CACHE_PATH.name)
+    try:
+        cached = json.loads(cache.read_text(encoding="utf-8"))
+        if cached["format"] != _CACHE_FORMAT or tuple(cached["source"]) != source:
+            raise ValueError("stale cache")
+        raw = cached["raw"]
+    except Exception:                       # no / stale / unreadable cache → parse
+        raw = yaml.load(path.read_text(encoding="utf-8"), Loader=_Loader) or {}
+        try:
+            text = json.dumps({"format": _CACHE_FORMAT, "source": source, "raw": raw})
+            if json.loads(text)["raw"] == raw:      # dates / non-string keys would not round-trip
+                cache.write_text(text, encoding="utf-8")
+        except (OSError, TypeError, ValueError):
+            pass                            # read-only folder or non-JSON YAML: just skip the cache
+    built = _build(raw, source)
+    _loaded[path] = built
+    return built
@@ -0,0 +1,317 @@
+# sync_engine.py  – concurrent parent uploads for main.py
+# -------------------------------------------------
+#  • Several parents are synced at the same time (woo_api.concurrency).
+#  • Every HTTP request is paced by the Woo client itself (woo_api.py:
+#    woo_api.rate_limit or adaptive pacing), shared by all threads.
+#  • Inside one parent the order is kept: parent POST ➜ variations batch ➜ DB.
+#  • Woo calls run in worker threads (woocommerce.API is blocking);
+#    DB writes stay on the event-loop thread, so the pyodbc connection
+#    is never used by two threads at once.
+#  • images.async_lane: parents are created without images and an
+#    ImageLane attaches them in the background (own concurrency + retries).
+#  • Every parent goes through the Outbox (outbox.py): leftovers of an
+#    interrupted run are refreshed from their fresh bucket and resumed at
+#    the step where they stopped.
+#  • Refused parents / variations go to the dead-letter queue.
+#  • An open Woo circuit pauses the run: no new parents are started and the
+#    unfinished ones stay in the outbox for the next run.
+# -------------------------------------------------
+import asyncio, json
+from transform import build_parent_and_children
+from settings import load_settings
+from outbox import Outbox, OutboxEntry
+from dead_letters import DeadLetters
+from woo_api import CircuitOpenError
+
+_woo_cfg = load_settings().woo_api
+_img_cfg = load_settings().images
+
+
+class ImageLane:
+    """
+    Background queue of (product_id, sku, images) jobs: `concurrency` workers PUT the
+    images of already-live products, retrying a failed job up to `retries` times
+    with exponential backoff. `call` runs one blocking Woo call (e.g. SyncEngine._call).
+    An open Woo circuit pauses the lane: the remaining jobs are dropped at once and
+    their images stay in the outbox for the next run.
+    """
+
+    def __init__(self, woo, call=None, concurrency: int | None = None, retries: int | None = None, on_done=None):
+        self.woo  = woo
+        self.call = call or (lambda fn, *args: asyncio.to_thread(fn, *args))
+        self.on_done = on_done              # on_done(sku) after a successful attach
+        self.concurrency = int(concurrency or _img_cfg.lane_concurrency)
+        self.retries     = int(retries if retries is not None else _img_cfg.lane_retries)
+        self.failed  = []
+        self.skipped = []                   # not tried because the circuit opened
+
+    @property
+    def paused(self):
+        return self._paused.is_set()
+
+    def start(self):
+        self._paused  = asyncio.Event()
+        self._queue   = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def put(self, product_id, sku, images):
+        if images:
+            self._queue.put_nowait((product_id, sku, images))
+
+    async def close(self):
+        """Wait until every queued job is done, then stop the workers."""
+        await self._queue.join()
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self.failed:
+            print(f"⚠ Images not attached for {len(self.failed)} product(s): {', '.join(map(str, self.failed))}")
+        if self.skipped:
+            print(f"⏸ Woo unreachable – images of {len(self.skipped)} product(s) left in the outbox")
+
+    async def _worker(self):
+        while True:
+            product_id, sku, images = await self._queue.get()
+            try:
+                await self._attach(product_id, sku, images)
+            finally:
+                self._queue.task_done()
+
+    async def _attach(self, product_id, sku, images):
+        for attempt in range(self.retries + 1):
+            if self.paused:
+                self.skipped.append(sku)
+                return
+            try:
+                resp = await self.call(self.woo.attach_images, product_id, images, sku)
+            except CircuitOpenError:
+                self._paused.set()                      # wakes the workers waiting in a backoff
+                self.skipped.append(sku)
+                return
+            except Exception as ex:
+                resp = {"message": str(ex)}
+            if resp.get("id"):
+                print(f"   🖼 Images attached: {sku} ({len(resp.get('images') or [])})")
+                if self.on_done:
+                    self.on_done(sku)
+                return
+            msg = resp.get("message", json.dumps(resp))
+            if attempt < self.retries:
+                print(f"   ↻ Images for {sku} failed ({msg}), retry {attempt + 1}/{self.retries}")
+                try:
+                    await asyncio.wait_for(self._paused.wait(), 2 ** (attempt + 1))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                print(f"   ✗ Images for {sku} failed: {msg}")
+                self.failed.append(sku)
+
+    async def drain(self, jobs):
+        """Run the lane over a ready list of (product_id, sku, images) jobs."""
+        self.start()
+        for job in jobs:
+            self.put(*job)
+        await self.close()
+
+
+def record_variation_results(db, parent_id, results, dead_letters=None, parent_sku=None):
+    """
+    Print the [(row_id, payload, item_resp), ...] list of Woo.post_variations_batch(),
+    bulk-mark the successes and return their [(row_id, parent_id, woo_id), ...] marks.
+    Failures are recorded in dead_letters (if given). If the DB write fails nothing
+    is returned, so the outbox keeps those variations pending, and they are queued
+    as dead letters too: their backoff grows instead of being re-sent at once.
+    """
+    marks = []
+    for row_id, var, v_resp in results:
+        var_sku = var["sku"]
+        if v_resp.get("id") and "error" not in v_resp:
+            var_id = v_resp["id"]
+            print(f"   ✔ Variation uploaded: {var_sku} → Woo ID {var_id}")
+            marks.append((row_id, parent_id, var_id))
+        else:
+            err = v_resp.get("error", v_resp)
+            msg = err.get("message", json.dumps(err))
+            print(f"   ✗ Variation {var_sku} failed: {msg}")
+            if dead_letters is not None:
+                dead_letters.add("variation", row_id, f"products/{parent_id}/variations", var, v_resp,
+                                 meta={"parent_id": parent_id, "parent_sku": parent_sku})
+    if not db.mark_uploaded_many(marks):
+        print(f"   ⚠ {len(marks)} variation(s) uploaded but not marked in the DB – kept in the outbox")
+        if dead_letters is not None:
+            payloads = {row_id: var for row_id, var, _ in results}
+            for row_id, _, var_id in marks:     # re-sending is safe: Woo answers the SKU conflict with its ID
+                dead_letters.add("variation", row_id, f"products/{parent_id}/variations", payloads[row_id],
+                                 RuntimeError(f"uploaded as Woo ID {var_id} but the DB mark failed"),
+                                 meta={"parent_id": parent_id, "parent_sku": parent_sku})
+        return []
+    if dead_letters is not None:
+        dead_letters.resolve("variation", [row_id for row_id, _, _ in marks])
+    return marks
+
+
+def queue_parent(outbox, parent_sku, bucket, image_lane=False):
+    """Transform one bucket and store it in the outbox; None when the parent is filtered out."""
+    parent_json, variations = build_parent_and_children(bucket)
+    if not parent_json:
+        print(f"⚠ Skipped {parent_sku} (filtered out)")
+        return None
+    images = parent_json.get("images") if image_lane else None
+    if images:
+        parent_json = {k: v for k, v in parent_json.items() if k != "images"}
+    return outbox.put(parent_sku, parent_json, variations, images)
+
+
+def skip_dead_letters(entry, dead_letters):
+    """
+    Drop the parts of entry the dead-letter queue owns (waiting for backoff or given up,
+    same payload). Returns None when nothing is left to send in this run.
+    """
+    if dead_letters.holds("parent", entry.parent_sku, entry.parent_json):
+        print(f"⏭ Parent {entry.parent_sku} is in the dead-letter queue – left to `python main.py retry`")
+        return None
+    held = [row_id for var, row_id in entry.variations if dead_letters.holds("variation", row_id, var)]
+    if held:
+        print(f"⏭ {len(held)} variation(s) of {entry.parent_sku} are in the dead-letter queue")
+        entry.variations = [(var, row_id) for var, row_id in entry.variations if row_id not in held]
+        if entry.parent_id and not entry.variations and not entry.images:
+            return None
+    return entry
+
+
+def with_leftovers(outbox, buckets):
+    """
+    Yield (parent_sku, rows) for the fresh buckets and (parent_sku, OutboxEntry) for the
+    parents an interrupted run left half-done in the outbox. A leftover whose bucket comes
+    by is refreshed from it first (outbox.put keeps the steps already done), so fixes at
+    the source and new sizes reach Woo; the leftovers the stream never brings come last.
+    """
+    leftovers = {entry.parent_sku: entry for entry in outbox.resumable()}
+    if leftovers:
+        print(f"↺ Resuming {len(leftovers)} parent(s) left in the outbox")
+    for parent_sku, rows in buckets:
+        entry = leftovers.pop(parent_sku, None)
+        if entry is None:
+            yield parent_sku, rows
+            continue
+        try:
+            # images only while still pending – the parent itself was created already
+            entry = queue_parent(outbox, parent_sku, rows, bool(entry.images)) or entry
+        except Exception as ex:
+            print(f"⚠ Could not refresh {parent_sku} from the DB ({ex}) – resuming the stored payload")
+        yield parent_sku, entry
+    for parent_sku, entry in leftovers.items():
+        yield parent_sku, entry
+
+
+class SyncEngine:
+    """Upload (parent_sku, rows) buckets with bounded parallelism; the Woo client paces the requests."""
+
+    def __init__(self, db, woo, concurrency: int | None = None, image_lane: bool | None = None,
+                 outbox: Outbox | None = None, dead_letters: DeadLetters | None = None):
+        self.db  = db
+        self.woo = woo
+        self.concurrency = int(concurrency or _woo_cfg.concurrency)
+        self.image_lane = _img_cfg.async_lane if image_lane is None else image_lane
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.dead_letters = dead_letters if dead_letters is not None else DeadLetters()
+
+    async def _call(self, fn, *args):
+        """Run one blocking Woo call in a worker thread."""
+        return await asyncio.to_thread(fn, *args)
+
+    async def _sync_parent(self, parent_sku, item):
+        entry = None
+        try:
+            entry = item if isinstance(item, OutboxEntry) else queue_parent(self.outbox, parent_sku, item, self.image_lane)
+            if entry and skip_dead_letters(entry, self.dead_letters):
+                await self._upload_parent(entry)
+        except CircuitOpenError:
+            self.paused = True                            # entry stays in the outbox
+        except Exception as ex:
+            # one broken parent must not cancel the others mid-upload
+            print(f"✗ Parent {parent_sku} failed with exception: {ex}")
+            if entry:
+                self.dead_letters.add("parent", parent_sku, "products", entry.parent_json, ex)
+        finally:
+            self._sem.release()
+
+    async def _upload_parent(self, entry):
+        """Run the steps entry still needs: parent ➜ variations ➜ images, recording each one."""
+        parent_sku, parent_id = entry.parent_sku, entry.parent_id
+
+        # 1) POST parent (without images when the image lane attaches them later)
+        if parent_id:
+            self.woo.skus.add(parent_sku, parent_id)
+            print(f"↺ Parent {parent_sku} already created → Woo ID {parent_id}")
+        else:
+            p_resp = await self._call(self.woo.post_product, entry.parent_json)
+            if "id" not in p_resp:
+                msg = p_resp.get("message", json.dumps(p_resp))
+                print(f"✗ Parent {parent_sku} failed: {msg}")
+                self.dead_letters.add("parent", parent_sku, "products", entry.parent_json, p_resp)
+                return
+            parent_id = p_resp["id"]
+            self.outbox.parent_created(parent_sku, parent_id)
+            self.dead_letters.resolve("parent", [parent_sku])
+            print(f"✔ Parent uploaded: {parent_sku} → Woo ID {parent_id}")
+
+        # 2) Variations only after their parent exists
+        if entry.variations:
+            results = await self._call(self.woo.post_variations_batch, parent_id, entry.variations)
+            marks = record_variation_results(self.db, parent_id, results, self.dead_letters, parent_sku)
+            self.outbox.variations_done(parent_sku, marks)
+
+        # 3) Images in the background lane – the product is already live
+        if entry.images and self._lane:
+            self._lane.put(parent_id, parent_sku, entry.images)
+        else:
+            self.outbox.finish(parent_sku)
+
+    async def run_async(self, buckets):
+        """
+        buckets: iterable of (parent_sku, rows) – may be a DB stream. The next bucket
+        is only pulled once a slot is free, so uploading starts while reading continues.
+        Outbox leftovers of an interrupted run are refreshed from their bucket and resumed.
+        """
+        self.paused  = False
+        self._sem    = asyncio.Semaphore(self.concurrency)
+        self._lane   = None
+        if self.image_lane or any(e.images for e in self.outbox.resumable()):
+            self._lane = ImageLane(self.woo, call=self._call, on_done=self.outbox.images_done)
+            self._lane.start()
+        it, tasks, done = iter(with_leftovers(self.outbox, buckets)), set(), object()
+        while True:
+            await self._sem.acquire()
+            if self._lane and self._lane.paused:
+                self.paused = True                        # the image lane hit the open circuit
+            if self.paused:
+                self._sem.release()
+                break
+            try:
+                item = await asyncio.to_thread(next, it, done)   # DB read off the event loop
+            except Exception:
+                # the DB stream broke: let the parents in flight finish, then fail the run
+                self._sem.release()
+                await asyncio.gather(*tasks)
+                raise
+            if item is done:
+                self._sem.release()
+                break
+            task = asyncio.create_task(self._sync_parent(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        if self._lane:
+            await self._lane.close()
+            self.paused = self.paused or self._lane.paused
+        if self.paused:
+            print(f"⏸ Woo unreachable – run paused, {len(self.outbox)} parent(s) pending in the outbox "
+                  f"(the rest is still unmarked in the DB); the next run resumes them")
+
+    def run(self, buckets):
+        """Blocking entry point used by main.py."""
+        lane = f", image lane x{_img_cfg.lane_concurrency}" if self.image_lane else ""
+        rate = "adaptive" if _woo_cfg.adaptive else (f"{_woo_cfg.rate_limit}/s" if _woo_cfg.rate_limit else "unlimited")
+        print(f"▶ Syncing parents, concurrency={self.concurrency}, rate={rate}{lane}\n")
+        asyncio.run(self.run_async(buckets))
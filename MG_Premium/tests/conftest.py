@@ -0,0 +1,106 @@
+# conftest.py  – the modules under test live one level up (MG_Premium/)
+import os, pathlib, sys, threading, types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("MG_CONFIG", str(ROOT / "config.yaml"))   # collectable from any cwd
+
+
+class Clock:
+    """Injectable clock for breakers, throttles and caches; tests move `now` by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StandIn:
+    """
+    Local stand-in for the shop: `mode` decides the answer of every request –
+    "up" (200 JSON), "down" (503), "reset" (socket closed without an answer)
+    or "broken" (chunked body cut off in the middle). Paths in `missing` answer 404.
+    """
+
+    def __init__(self):
+        self.mode = "up"
+        self.hits = 0
+        self.content_type = "application/json"
+        self.missing = set()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _answer(self):
+                stand_in.hits += 1
+                length = int(self.headers.get("content-length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if stand_in.mode == "reset":
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if stand_in.mode == "broken":
+                    self.send_response(200)
+                    self.send_header("content-type", "application/json")
+                    self.send_header("transfer-encoding", "chunked")
+                    self.end_headers()
+                    self.wfile.write(b"ff\r\n{\"id\": 1")
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                body = b'{"id": 1}' if stand_in.mode == "up" else b'{"code": "unavailable"}'
+                status = 200 if stand_in.mode == "up" else 503
+                self.send_response(404 if self.path in stand_in.missing else status)
+                self.send_header("content-type", stand_in.content_type)
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_HEAD = _answer
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def main(monkeypatch):
+    """main.py with the environment, season calendar, SKU seeding and outbox file stubbed out."""
+    try:
+        import db  # noqa: F401
+    except ImportError:                                # no ODBC driver here: main only needs the names
+        monkeypatch.setitem(sys.modules, "db", types.SimpleNamespace(DB=None, PARENT_KEY_COLS=()))
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    import main
+    from outbox import Outbox
+    monkeypatch.setattr(main, "_load_env", lambda: None)
+    monkeypatch.setattr(main, "start_run", lambda: types.SimpleNamespace(as_of=None, current=None, recent=()))
+    monkeypatch.setattr(main, "_seed_sku_index", lambda db, woo: None)
+    monkeypatch.setattr(main, "Outbox", lambda path: Outbox())
+    return main
@@ -0,0 +1,104 @@
+# test_dead_letters.py  – dead-letter backoff, ownership and the `main.py retry` loop
+import types
+
+import sync_engine
+from dead_letters import DeadLetters
+
+
+def refuse(dead_letters, key=7, payload=None):
+    dead_letters.add("variation", key, "products/5/variations", payload or {"sku": "P-S"},
+                     {"code": "woocommerce_rest_error", "message": "nope"}, meta={"parent_id": 5, "parent_sku": "P"})
+
+
+def test_backoff_doubles_and_gives_up(clock):
+    dead_letters = DeadLetters(backoff_base=30, max_attempts=3, clock=clock)
+    refuse(dead_letters)
+    assert dead_letters.due() == [] and dead_letters.next_due() == 30
+    clock.now = 30
+    refuse(dead_letters)
+    assert dead_letters.next_due() == 30 + 60
+    refuse(dead_letters)
+    assert dead_letters.next_due() is None
+    assert dead_letters.exhausted() == [("variation", "7", "woocommerce_rest_error", "nope")]
+
+
+def test_holds_until_due_unless_the_payload_changed(clock):
+    dead_letters = DeadLetters(backoff_base=30, max_attempts=2, clock=clock)
+    refuse(dead_letters)
+    assert dead_letters.holds("variation", 7, {"sku": "P-S"})
+    assert not dead_letters.holds("variation", 7, {"sku": "P-S", "regular_price": "9"})
+    clock.now = 30
+    assert not dead_letters.holds("variation", 7, {"sku": "P-S"})
+    refuse(dead_letters)                               # max_attempts reached: held for good …
+    clock.now = 10_000
+    assert dead_letters.holds("variation", 7, {"sku": "P-S"})
+
+
+def test_reset_gives_exhausted_items_new_attempts(clock):
+    dead_letters = DeadLetters(backoff_base=30, max_attempts=1, clock=clock)
+    refuse(dead_letters, key=7)
+    refuse(dead_letters, key=8)
+    assert dead_letters.reset(8) == 1
+    assert [item.key for item in dead_letters.due()] == ["8"]
+    assert dead_letters.reset() == 1
+    assert not dead_letters.exhausted() and not dead_letters.holds("variation", 7)
+
+
+def test_db_mark_failure_is_queued_with_backoff(clock):
+    class DB:
+        def mark_uploaded_many(self, marks):
+            return False
+
+    dead_letters = DeadLetters(backoff_base=30, clock=clock)
+    results = [(7, {"sku": "P-S"}, {"id": 90})]
+    assert sync_engine.record_variation_results(DB(), 5, results, dead_letters, "P") == []
+    assert dead_letters.holds("variation", 7, {"sku": "P-S"})
+    assert dead_letters.next_due() == 30
+
+
+def run_retry(main, monkeypatch, dead_letters, mark_ok):
+    posts = []
+
+    class Woo:
+        media = types.SimpleNamespace(save=lambda: None)
+
+        def __init__(self, debug=False):
+            pass
+
+        def post_variations_batch(self, parent_id, variations):
+            posts.append([row_id for _, row_id in variations])
+            return [(row_id, var, {"id": 90}) for var, row_id in variations]
+
+    class DB:
+        def mark_uploaded_many(self, marks):
+            return mark_ok
+
+    monkeypatch.setattr(main, "open_dead_letters", lambda cfg: dead_letters)
+    monkeypatch.setattr(main, "DB", DB)
+    monkeypatch.setattr(main, "Woo", Woo)
+    main.retry()
+    return posts
+
+
+def test_retry_backs_off_when_the_db_mark_fails(main, monkeypatch):
+    dead_letters = DeadLetters(backoff_base=0.01, max_attempts=3)
+    refuse(dead_letters)
+    posts = run_retry(main, monkeypatch, dead_letters, mark_ok=False)
+    assert posts == [[7], [7]]                         # attempts 2 and 3, then given up – no busy loop
+    assert [row[:2] for row in dead_letters.exhausted()] == [("variation", "7")]
+
+
+def test_retry_never_replays_an_item_that_was_not_requeued(main, monkeypatch):
+    dead_letters = DeadLetters(backoff_base=0.01, max_attempts=5)
+    refuse(dead_letters)
+    replays = []
+    monkeypatch.setattr(main, "_replay", lambda *args: replays.append(args[-1].key) or False)
+    run_retry(main, monkeypatch, dead_letters, mark_ok=True)
+    assert replays == ["7"]
+
+
+def test_retry_success_clears_the_item(main, monkeypatch):
+    dead_letters = DeadLetters(backoff_base=0.01)
+    refuse(dead_letters)
+    assert run_retry(main, monkeypatch, dead_letters, mark_ok=True) == [[7]]
+    assert len(dead_letters) == 0
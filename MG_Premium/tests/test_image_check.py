@@ -0,0 +1,70 @@
+# test_image_check.py  – image pre-flight against a local stand-in image host
+import requests
+
+from image_check import ImagePreflight
+from media_cache import MediaCache
+from woo_api import CircuitBreaker, RateLimiter, SkuIndex, Woo
+
+
+def payload(stand_in, *names):
+    return {"sku": "P1", "images": [{"src": f"{stand_in.url}/{name}"} for name in names]}
+
+
+def test_missing_images_are_dropped_and_cached(stand_in, clock):
+    stand_in.content_type = "image/jpeg"
+    stand_in.missing = {"/b.jpg"}
+    preflight = ImagePreflight(requests.Session(), workers=2, clock=clock)
+
+    [kept] = preflight.strip([payload(stand_in, "a.jpg", "b.jpg")])
+    assert [img["src"] for img in kept["images"]] == [f"{stand_in.url}/a.jpg"]
+    preflight.strip([payload(stand_in, "a.jpg", "b.jpg")])
+    assert stand_in.hits == 2                          # second run answered from the cache
+
+
+def test_unclear_answers_keep_the_image(stand_in, clock):
+    stand_in.mode = "down"                             # 503: the host cannot tell, Woo decides
+    preflight = ImagePreflight(requests.Session(), clock=clock)
+    [kept] = preflight.strip([payload(stand_in, "a.jpg")])
+    assert len(kept["images"]) == 1
+
+
+def test_checks_are_paced_by_the_shared_throttle(stand_in, clock):
+    stand_in.content_type = "image/jpeg"
+    waits = []
+    preflight = ImagePreflight(requests.Session(), workers=1, clock=clock,
+                               throttle=RateLimiter(2, burst=1, clock=clock, sleep=waits.append))
+    preflight.check([f"{stand_in.url}/{name}" for name in ("a.jpg", "b.jpg", "c.jpg")])
+    assert stand_in.hits == 3 and waits == [0.5, 1.0]
+
+
+def test_skipped_while_the_circuit_is_open(stand_in, clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30, clock=clock)
+    breaker.failure()
+    preflight = ImagePreflight(requests.Session(), clock=clock, breaker=breaker)
+    stand_in.missing = {"/b.jpg"}
+
+    [kept] = preflight.strip([payload(stand_in, "a.jpg", "b.jpg")])
+    assert len(kept["images"]) == 2 and stand_in.hits == 0
+
+
+def test_batch_upload_preflights_each_chunk_just_before_sending(monkeypatch):
+    events = []
+
+    class Preflight:
+        def strip(self, payloads, known=None):
+            events.append(("check", [p["sku"] for p in payloads]))
+            return payloads
+
+    woo = Woo.__new__(Woo)
+    woo.batch_size, woo.skus, woo.media, woo.preflight, woo.debug = 2, SkuIndex(), MediaCache(None), Preflight(), False
+
+    def upsert(endpoint, payloads, parent_id=None):
+        events.append(("send", [p["sku"] for p in payloads]))
+        return [{"id": n} for n, _ in enumerate(payloads, 1)]
+    monkeypatch.setattr(woo, "_upsert", upsert)
+
+    payloads = [{"sku": sku, "images": [{"src": f"http://img/{sku}.jpg"}]} for sku in "ABCDE"]
+    assert len(woo.post_products_batch(payloads)) == 5
+    assert events == [("check", ["A", "B"]), ("send", ["A", "B"]),
+                      ("check", ["C", "D"]), ("send", ["C", "D"]),
+                      ("check", ["E"]), ("send", ["E"])]
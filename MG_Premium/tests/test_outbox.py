@@ -0,0 +1,39 @@
+# test_outbox.py  – resuming interrupted parents from the outbox
+import sync_engine
+from outbox import Outbox
+
+
+def build(bucket):
+    """rows are (row_id, size, price) – one variation each."""
+    sku = bucket[0][1].split("-")[0]
+    return {"sku": sku}, [({"sku": size, "regular_price": price}, row_id) for row_id, size, price in bucket]
+
+
+def test_leftover_is_refreshed_from_its_fresh_bucket(monkeypatch):
+    monkeypatch.setattr(sync_engine, "build_parent_and_children", build)
+    outbox = Outbox()
+    outbox.put("P", {"sku": "P"}, [({"sku": "P-S", "regular_price": "10"}, 1),
+                                   ({"sku": "P-M", "regular_price": "10"}, 2)])
+    outbox.parent_created("P", 50)
+    outbox.variations_done("P", [(1, 50, 91)])         # P-S went through before the run stopped
+    outbox.put("Q", {"sku": "Q"}, [({"sku": "Q-S", "regular_price": "5"}, 9)])
+    outbox.parent_created("Q", 60)
+
+    fresh = [("N", [(20, "N-S", "7")]),
+             ("P", [(2, "P-M", "12"), (3, "P-L", "12")])]   # price fixed at the source, a size added
+    items = list(sync_engine.with_leftovers(outbox, fresh))
+
+    assert [sku for sku, _ in items] == ["N", "P", "Q"]     # Q is not in the stream: resumed last
+    entry = items[1][1]
+    assert entry.parent_id == 50
+    assert entry.variations == [({"sku": "P-M", "regular_price": "12"}, 2),
+                                ({"sku": "P-L", "regular_price": "12"}, 3)]
+    assert items[0][1] == [(20, "N-S", "7")]                 # plain buckets pass through untouched
+
+
+def test_refused_parent_is_rebuilt_instead_of_resumed(monkeypatch):
+    monkeypatch.setattr(sync_engine, "build_parent_and_children", build)
+    outbox = Outbox()
+    outbox.put("P", {"sku": "P", "name": "bad"}, [])       # never created on Woo
+    items = list(sync_engine.with_leftovers(outbox, [("P", [(1, "P-S", "10")])]))
+    assert items == [("P", [(1, "P-S", "10")])] and outbox.get("P") is None
@@ -0,0 +1,55 @@
+# test_pooled_api.py  – what PooledAPI hands to the shared session
+from urllib.parse import parse_qs, urlsplit
+
+from woo_api import PooledAPI
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return type("Response", (), {"status_code": 200, "headers": {}})()
+
+
+def make_api(url, **kwargs):
+    api = PooledAPI(url, "ck_1", "cs_1", version="wc/v3", timeout=20, connect_timeout=5, **kwargs)
+    api.session, api.throttle, api.breaker = FakeSession(), None, None
+    return api
+
+
+def test_https_uses_basic_auth_and_split_timeouts():
+    api = make_api("https://shop.example/")
+    api.put("products/7", {"regular_price": "9"}, params={"force": "true"})
+
+    [(method, url, kwargs)] = api.session.calls
+    assert (method, url) == ("PUT", "https://shop.example/wp-json/wc/v3/products/7")
+    assert kwargs["auth"] == ("ck_1", "cs_1")
+    assert kwargs["timeout"] == (5, 20)
+    assert kwargs["params"] == {"force": "true"}
+    assert kwargs["data"] == b'{"regular_price": "9"}'
+    assert kwargs["headers"]["content-type"] == "application/json;charset=utf-8"
+    assert kwargs["verify"] is True
+
+
+def test_https_query_string_auth():
+    api = make_api("https://shop.example", query_string_auth=True)
+    api.get("products", params={"sku": "A"})
+
+    [(_, _, kwargs)] = api.session.calls
+    assert kwargs["auth"] is None
+    assert kwargs["params"] == {"sku": "A", "consumer_key": "ck_1", "consumer_secret": "cs_1"}
+
+
+def test_plain_http_is_oauth_signed_through_the_session():
+    api = make_api("http://shop.local")
+    api.get("products", params={"sku": "A"})
+
+    [(method, url, kwargs)] = api.session.calls
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    assert (method, parts.path) == ("GET", "/wp-json/wc/v3/products")
+    assert query["sku"] == ["A"] and query["oauth_consumer_key"] == ["ck_1"] and "oauth_signature" in query
+    assert kwargs["auth"] is None and kwargs["params"] == {}
+    assert kwargs["timeout"] == (5, 20)
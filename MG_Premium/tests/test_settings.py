@@ -0,0 +1,66 @@
+# test_settings.py  – typed config sections and the .config.cache
+import json, pickle
+
+import pytest
+
+import settings
+from settings import ConfigError, load_settings
+
+MINIMAL = """
+db:
+  table: Eshop
+  id_col: id
+  sync_table: Sync
+  sync_product_ref_col: ref
+  sync_uploaded_col: uploaded
+  sync_external_id_col: ext
+  sync_parent_id_col: parent
+  sync_uploaded_date_col: uploaded_date
+  sync_updated_date_col: updated_date
+images:
+  base_url: https://img.example/
+woo_api:
+  batch_parents: true
+"""
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "_loaded", {})
+    path = tmp_path / "config.yaml"
+    path.write_text(MINIMAL, encoding="utf-8")
+    return path
+
+
+def test_typed_sections(config):
+    loaded = load_settings(config)
+    assert loaded.woo_api.batch_parents is True
+    assert loaded.db.sync_pushed_hash_col == ""                 # push every row unless configured
+
+
+def test_unknown_key_is_an_error(config):
+    config.write_text(MINIMAL.replace("batch_parents", "batch_parent"), encoding="utf-8")
+    with pytest.raises(ConfigError, match="unknown key.*batch_parent"):
+        load_settings(config)
+
+
+def test_non_bool_flag_is_an_error(config):
+    config.write_text(MINIMAL.replace("batch_parents: true", 'batch_parents: "false"'), encoding="utf-8")
+    with pytest.raises(ConfigError, match="true or false"):
+        load_settings(config)
+
+
+def test_cache_is_plain_json_and_rebuilt(config):
+    first = load_settings(config)
+    cached = json.loads((config.parent / ".config.cache").read_text(encoding="utf-8"))
+    assert cached["raw"]["woo_api"] == {"batch_parents": True}
+
+    settings._loaded.clear()
+    assert load_settings(config) == first
+
+
+def test_a_pickle_in_the_cache_is_never_loaded(config, monkeypatch):
+    stat = config.stat()
+    (config.parent / ".config.cache").write_bytes(pickle.dumps((1, (stat.st_mtime_ns, stat.st_size), "boom")))
+    monkeypatch.setattr(pickle, "loads", lambda *args: pytest.fail("cache was unpickled"))
+    assert load_settings(config).woo_api.batch_parents is True
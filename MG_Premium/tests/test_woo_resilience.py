@@ -0,0 +1,197 @@
+# test_woo_resilience.py  – circuit breaker, engine pause and image lane against a local stand-in shop
+import asyncio, dataclasses, time, types
+
+import pytest
+import requests
+
+import sync_engine
+import woo_api
+from outbox import Outbox
+from woo_api import AdaptiveThrottle, CircuitBreaker, CircuitOpenError, PooledAPI, RateLimiter
+
+
+def make_api(stand_in, breaker):
+    api = PooledAPI(stand_in.url, "ck", "cs", version="wc/v3", timeout=2, connect_timeout=1)
+    api.breaker, api.throttle, api.retries = breaker, None, 0
+    return api
+
+
+def test_breaker_opens_half_opens_and_closes(stand_in, clock):
+    api = make_api(stand_in, CircuitBreaker(threshold=3, reset_timeout=30, clock=clock))
+
+    stand_in.mode = "down"
+    assert [api.get("products").status_code for _ in range(3)] == [503] * 3
+    assert api.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        api.get("products")
+    assert stand_in.hits == 3                          # fails fast, the shop is left alone
+
+    clock.now = 31                                     # half-open: one probe, still down → open again
+    assert api.breaker.state == "half-open"
+    assert api.get("products").status_code == 503
+    assert api.breaker.state == "open" and stand_in.hits == 4
+
+    clock.now = 62
+    stand_in.mode = "up"
+    assert api.get("products").json() == {"id": 1}
+    assert api.breaker.state == "closed" and api.breaker.failures == 0
+
+
+def test_closed_sockets_count_as_failures(stand_in, clock):
+    api = make_api(stand_in, CircuitBreaker(threshold=2, reset_timeout=30, clock=clock))
+    stand_in.mode = "reset"
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            api.get("products")
+    assert api.breaker.state == "open"
+
+
+def test_broken_probe_reopens_the_circuit(stand_in, clock):
+    api = make_api(stand_in, CircuitBreaker(threshold=1, reset_timeout=30, clock=clock))
+    stand_in.mode = "down"
+    api.get("products")
+    clock.now = 31
+
+    stand_in.mode = "broken"                           # the probe dies in the middle of the body
+    with pytest.raises(requests.RequestException):
+        api.get("products")
+    assert api.breaker.state == "open" and not api.breaker._probing
+
+
+def test_local_error_frees_the_probe(stand_in, clock, monkeypatch):
+    api = make_api(stand_in, CircuitBreaker(threshold=1, reset_timeout=30, clock=clock))
+    stand_in.mode = "down"
+    api.get("products")
+    clock.now = 31
+
+    def explode(*args, **kwargs):
+        raise ValueError("bad payload")
+    monkeypatch.setattr(api, "_send_once", explode)
+    with pytest.raises(ValueError):
+        api.get("products")
+    monkeypatch.undo()
+
+    stand_in.mode = "up"                               # the next call may probe again
+    assert api.get("products").status_code == 200
+    assert api.breaker.state == "closed"
+
+
+def test_batch_update_is_retried_and_counted_once(stand_in, clock, monkeypatch):
+    monkeypatch.setattr(woo_api, "_woo_cfg", dataclasses.replace(woo_api._woo_cfg, retry_backoff=0))
+    api = make_api(stand_in, CircuitBreaker(threshold=5, reset_timeout=30, clock=clock))
+    api.retries = 2
+    stand_in.mode = "down"
+
+    assert api.post("products/batch", {"update": [{"id": 1}]}, idempotent=True).status_code == 503
+    assert stand_in.hits == 3 and api.breaker.failures == 1
+
+    assert api.post("products", {"sku": "A"}).status_code == 503   # a create is never re-sent on 5xx
+    assert stand_in.hits == 4 and api.breaker.failures == 2
+
+
+def test_rate_limit_paces_every_http_request(stand_in, clock, monkeypatch):
+    monkeypatch.setattr(woo_api, "_woo_cfg", dataclasses.replace(woo_api._woo_cfg, retry_backoff=0))
+    api = make_api(stand_in, None)
+    waits = []
+    api.throttle, api.retries = RateLimiter(2, burst=1, clock=clock, sleep=waits.append), 2
+    stand_in.mode = "down"
+
+    api.put("products/1", {"regular_price": "9"})      # one logical call, three HTTP requests
+    assert stand_in.hits == 3
+    assert waits == [0.5, 1.0]                         # the retries wait for their slots too
+
+
+def test_slow_batches_do_not_cut_the_adaptive_rate(clock):
+    throttle = AdaptiveThrottle(8, min_rate=0.5, max_rate=20, target_latency=2.0, clock=clock, sleep=lambda s: None)
+    batch = {"create": [{"sku": f"S{i}", "images": [{"src": "u"}]} for i in range(50)]}
+    assert woo_api._work_units(batch) == 100 and woo_api._work_units({"sku": "A"}) == 1
+
+    throttle.record(30.0, ok=True, units=woo_api._work_units(batch))   # 30 s for 50 creates + 50 sideloads
+    assert throttle.rate > 8
+    clock.now = 5
+    throttle.record(30.0, ok=True)                                     # 30 s for a single product: struggling
+    assert throttle.rate < 8
+    clock.now = 10
+    rate = throttle.rate
+    throttle.record(0.1, ok=False, units=100)                          # 429/5xx/timeout always cut
+    assert throttle.rate < rate
+
+
+class FakeWoo:
+    """Just enough of woo_api.Woo for SyncEngine, sending the parents to the stand-in."""
+
+    class Skus:
+        def add(self, *args):
+            pass
+
+    def __init__(self, api):
+        self.wc, self.skus = api, self.Skus()
+
+    def post_product(self, payload):
+        return self.wc.post("products", payload).json()
+
+    def post_variations_batch(self, parent_id, variations):
+        return [(row_id, var, {"id": 9}) for var, row_id in variations]
+
+
+class FakeDB:
+    def mark_uploaded_many(self, marks):
+        return True
+
+
+def test_engine_pauses_on_open_circuit(stand_in, clock, monkeypatch):
+    monkeypatch.setattr(sync_engine, "build_parent_and_children",
+                        lambda bucket: ({"sku": bucket[0]}, [({"sku": bucket[0] + "-S"}, 1)]))
+    api = make_api(stand_in, CircuitBreaker(threshold=3, reset_timeout=30, clock=clock))
+    stand_in.mode = "down"
+    pulled = []
+
+    def buckets():
+        for i in range(100):
+            pulled.append(i)
+            yield f"p{i}", [f"p{i}"]
+
+    outbox = Outbox()
+    engine = sync_engine.SyncEngine(FakeDB(), FakeWoo(api), concurrency=1, image_lane=False, outbox=outbox)
+    engine.run(buckets())
+
+    assert engine.paused
+    assert stand_in.hits == 3                          # nothing is sent once the circuit opened
+    assert len(pulled) < 10                            # the stream stops instead of failing every bucket
+    assert "p3" in [e.parent_sku for e in outbox.pending()]
+
+
+def test_image_lane_stops_without_waiting_for_backoff():
+    class Woo:
+        def attach_images(self, product_id, images, sku):
+            if sku == "a":
+                return {"message": "busy"}             # worker 1 goes into its backoff
+            raise CircuitOpenError("open")
+
+    done = []
+    lane = sync_engine.ImageLane(Woo(), concurrency=2, retries=3, on_done=done.append)
+    started = time.monotonic()
+    asyncio.run(lane.drain([(1, "a", ["x"]), (2, "b", ["x"]), (3, "c", ["x"]), (4, "d", ["x"])]))
+
+    assert time.monotonic() - started < 1
+    assert lane.paused and not done
+    assert sorted(lane.skipped) == ["a", "b", "c", "d"]
+
+
+def test_run_pauses_when_the_shop_is_down_at_startup(main, monkeypatch, capsys):
+    class Woo:
+        media = types.SimpleNamespace(save=lambda: None)
+
+        def __init__(self, debug=False):
+            pass
+
+    def seed(db, woo):
+        raise CircuitOpenError("open")
+
+    monkeypatch.setattr(main, "DB", lambda: None)
+    monkeypatch.setattr(main, "Woo", Woo)
+    monkeypatch.setattr(main, "open_dead_letters", lambda cfg: None)
+    monkeypatch.setattr(main, "_parent_buckets", lambda *args: iter(()))
+    monkeypatch.setattr(main, "_seed_sku_index", seed)
+    main.main()
+    assert "⏸ Woo unreachable – run paused" in capsys.readouterr().out
@@ -1,12 +1,14 @@
 # transform.py  – turn raw DB rows into Woo JSON
 # -------------------------------------------------
-import yaml, pathlib, re, datetime, os
+import re, datetime, os, functools
 from collections import defaultdict
+from settings import load_settings
 
 # -------------------------
 # load YAML once
 # -------------------------
-_cfg = yaml.safe_load(pathlib.Path("config.yaml").read_text(encoding="utf-8"))
+settings = load_settings()
+_cfg = settings.raw
 
 # Handy aliases from config.yaml
 _fmap         = _cfg["field_map"]
@@ -19,26 +21,39 @@ sizes_order = [x.lower() for x in _cfg.get("sizes_order", [])]
 cups_order = [x.upper() for x in _cfg.get("cups_order", [])]
 
 # Images from config.yaml
-_img_cfg = _cfg["images"]
-_img_cols = _img_cfg["columns"]
-base_url = _img_cfg["base_url"]
-file_ext = _img_cfg.get("file_ext", ".jpg")
-skip_empty = _img_cfg.get("skip_empty", True)
+_img_cols = list(settings.images.columns)
+base_url = settings.images.base_url
+file_ext = settings.images.file_ext
+skip_empty = settings.images.skip_empty
 
 # Season logic from config.yaml
-season_cfg = _cfg.get("season_logic", {})
-summer_month = season_cfg.get("summer_cutoff", {}).get("month", 3)
-summer_day   = season_cfg.get("summer_cutoff", {}).get("day", 1)
-winter_month = season_cfg.get("winter_cutoff", {}).get("month", 9)
-winter_day   = season_cfg.get("winter_cutoff", {}).get("day", 1)
-num_recent   = season_cfg.get("num_recent", 2)
+season_cfg = _cfg.get("season_logic", {})      # read by SeasonCalendar
 
 # Filters from config.yaml 
 _filters = _cfg.get("filters", {})
 _allowed_brands = {b.strip().lower() for b in _filters.get("allowed_brands", [])}
 
 # List of warehouse columns used to compute actual stock
-_stock_columns = _cfg.get("stock_columns", [])
+_stock_columns = list(settings.stock_columns)
+
+# Columns the helpers below read by fixed name (on top of the config-driven ones)
+_FIXED_COLUMNS = (
+    "b_Style", "b_Color", "b_Size", "RP", "Brand", "Gender",
+    "L_1", "L_2", "L_3", "c_L2", "L_Sea", "Cup", "Fit",
+    "c_P1", "c_P2", "c_P3", "c_P4", "c_P5", "Composition1", "Care_Instr",
+)
+
+def source_columns():
+    """
+    Every DB column this module reads: field_map, attributes, images.columns,
+    stock_columns and the fixed set above. Used by DB to project the SELECT list.
+    """
+    cols = list(_FIXED_COLUMNS)
+    cols += list(_fmap)
+    cols += [rule["db_col"] for rule in _attr_rules.values()]
+    cols += list(_img_cols)
+    cols += list(_stock_columns)
+    return list(dict.fromkeys(cols))
 
 # -------------------------
 # helper: debugging. Call to return a 0 anywhere you choose.
@@ -53,85 +68,155 @@ def noop(row):
 def concat_style_color(row):
     return f"{row['b_Style'].strip()}-{row['b_Color'].strip()}"
 
+def variation_sku(parent_sku, size):
+    return f"{parent_sku}-{str(size).strip()}"
+
 def same_as_parent_key(row):
     return concat_style_color(row)
 
 # -------------------------
 # helper: compute seasons
 # -------------------------
+class SeasonCalendar:
+    """
+    Season codes for one run, computed once from config.yaml → season_logic.
+      as_of   – the fixed date the whole run uses (a run crossing midnight keeps it)
+      current – the single most recent season code (e.g. '252')
+      recent  – frozenset of the num_recent most recent codes
+    clock is injectable (any callable returning a date) for tests / back-dated runs.
+    """
+
+    def __init__(self, season_logic: dict | None = None, clock=datetime.date.today):
+        logic = season_cfg if season_logic is None else season_logic
+        s_cut = logic.get("summer_cutoff", {})
+        w_cut = logic.get("winter_cutoff", {})
+        summer_cut = (s_cut.get("month", 3), s_cut.get("day", 1))
+        winter_cut = (w_cut.get("month", 9), w_cut.get("day", 1))
+        n_recent   = logic.get("num_recent", 2)
+
+        today = self.as_of = clock()
+        yy    = today.year % 100
+        md    = (today.month, today.day)
+        summer = f"{yy:02d}1" if md >= summer_cut else f"{yy-1:02d}1"
+        winter = f"{yy:02d}2" if md >= winter_cut else f"{yy-1:02d}2"
+
+        # Most recent single code: this winter, else this summer, else last winter
+        if md >= winter_cut:
+            self.current = f"{yy:02d}2"
+        elif md >= summer_cut:
+            self.current = f"{yy:02d}1"
+        else:
+            self.current = f"{yy-1:02d}2"
+
+        # Collect most recent N season codes (e.g., {242, 241})
+        if n_recent >= 2:
+            y_prev  = (today.year - 1) % 100
+            seasons = [winter, summer, f"{y_prev:02d}2", f"{y_prev:02d}1"]   # previous winter, summer
+        else:
+            seasons = [winter]  # fallback
+        self.recent = frozenset(seasons[:n_recent])
+
+    def is_recent(self, code: str) -> bool:
+        return code in self.recent
+
+_calendar = None
+
+def season_calendar() -> SeasonCalendar:
+    """The run-scoped calendar; built on first use, then fixed for the rest of the run."""
+    global _calendar
+    if _calendar is None:
+        _calendar = SeasonCalendar()
+    return _calendar
+
+def start_run(clock=datetime.date.today) -> SeasonCalendar:
+    """Pin a fresh calendar (optionally with an injected clock) at the start of a run."""
+    global _calendar
+    _calendar = SeasonCalendar(clock=clock)
+    return _calendar
+
 def recent_season_codes():
     """
     Return a set of most recent season codes:
-      - the logic is set in config.yaml
+      - the logic is set in config.yaml, computed once per run (see SeasonCalendar)
+    """
+    return set(season_calendar().recent)
+
+def upload_filters():
+    """
+    The brand whitelist and recent-season rules of build_parent_payload() as
+    {column: allowed values (lower-case)}, so DB can apply them in the WHERE clause.
+    build_parent_payload() still checks them as a safety net.
     """
-    today = datetime.date.today()
-    yy    = today.year % 100
-
-    # Determine current and previous season codes using config
-    # Summer
-    if (today.month, today.day) >= (summer_month, summer_day):
-        summer = f"{yy}1"
-    else:
-        summer = f"{yy-1:02d}1"
-    # Winter
-    if (today.month, today.day) >= (winter_month, winter_day):
-        winter = f"{yy}2"
-    else:
-        winter = f"{yy-1:02d}2"
-
-    # Collect most recent N season codes (e.g., {242, 241})
-    seasons = []
-    if num_recent >= 2:
-        seasons.append(winter)
-        seasons.append(summer)
-        # If you want more, go further back:
-        y_prev = (today.year-1) % 100
-        if num_recent > 2:
-            seasons.append(f"{y_prev}2")  # previous winter
-        if num_recent > 3:
-            seasons.append(f"{y_prev}1")  # previous summer
-        # ...extend logic as needed
-    else:
-        seasons = [winter]  # fallback
-
-    return set(seasons[:num_recent])
+    return {
+        "Brand": set(_allowed_brands),
+        "L_Sea": {s.lower() for s in season_calendar().recent},
+    }
 
 def current_season_code():
     """
     Return only the most recent single season code:
-      - Winter if ≥ Sept 1 (YY2)
-      - Else Summer if ≥ Mar 1 (YY1)
+      - Winter if ≥ winter_cutoff (YY2)
+      - Else Summer if ≥ summer_cutoff (YY1)
       - Else last year's Winter
     """
-    today = datetime.date.today()
-    yy    = today.year % 100
-    if (today.month, today.day) >= (9,1):
-        return f"{yy}2"
-    if (today.month, today.day) >= (3,1):
-        return f"{yy}1"
-    return f"{yy-1:02d}2"
+    return season_calendar().current
 
 # -------------------------
 # color + stock helpers (re-used from script)
 # -------------------------
+class SizeOrder:
+    """
+    Size ordering built once from config.yaml (sizes_order / cups_order):
+      band+cup sizes first (75B < 75C < 80B), then letter sizes in sizes_order,
+      then anything else alphabetically. Rank lookups are dicts, keys are cached.
+    """
+    _BAND_CUP = re.compile(r"^(\d+)([a-z]+)$")
+
+    def __init__(self, sizes: list[str], cups: list[str]):
+        self.size_rank = {s.lower(): i for i, s in reversed(list(enumerate(sizes)))}   # first wins
+        self.cup_rank  = {c.upper(): i for i, c in reversed(list(enumerate(cups)))}
+        self.key = functools.lru_cache(maxsize=None)(self._key)
+
+    def _key(self, s):
+        s_clean = s.strip().lower()
+        m = self._BAND_CUP.match(s_clean)
+        if m:
+            band = int(m.group(1))
+            cup  = m.group(2).upper()
+            cup_idx = self.cup_rank.get(cup, ord(cup[0]) if cup else 999)
+            return (0, band, cup_idx)
+        if s_clean in self.size_rank:
+            return (1, self.size_rank[s_clean])
+        return (2, s_clean)
+
+    def sort(self, sizes):
+        sizes = [s.strip() for s in sizes if s.strip()]
+        return sorted(set(sizes), key=self.key)
+
+    def index_rows(self, rows, size_col="b_Size"):
+        """
+        One pass over a bucket: returns (sorted sizes, {size: row}, duplicate rows).
+        The first row of a size wins; later rows with the same size are returned
+        as duplicates so the caller can report them.
+        """
+        by_size, duplicates = {}, []
+        for r in rows:
+            size = str(r.get(size_col) or "").strip()
+            if not size:
+                continue
+            if size in by_size:
+                duplicates.append(r)
+            else:
+                by_size[size] = r
+        return sorted(by_size, key=self.key), by_size, duplicates
+
+_size_order = SizeOrder(sizes_order, cups_order)
+
 def size_sort_key(s):
-    s_clean = s.strip().lower()
-    m = re.match(r"^(\d+)([a-z]+)$", s_clean)
-    if m:
-        band = int(m.group(1))
-        cup  = m.group(2).upper()
-        try:
-            cup_idx = cups_order.index(cup)
-        except ValueError:
-            cup_idx = ord(cup[0]) if cup else 999
-        return (0, band, cup_idx)
-    if s_clean in sizes_order:
-        return (1, sizes_order.index(s_clean))
-    return (2, s_clean)
+    return _size_order.key(s)
 
 def sort_sizes_naturally(sizes):
-    sizes = [s.strip() for s in sizes if s.strip()]
-    return sorted(set(sizes), key=size_sort_key)
+    return _size_order.sort(sizes)
 
 def calculate_actual_stock(row):
     """
@@ -190,199 +275,103 @@ def _normalize_crumb(s: str) -> str:
     parts = [p.strip().lower() for p in s.split(">")]
     return ">".join(parts)
 
-def build_categories(row) -> str:
+# Keys a category rule may use; the index points into the memo key tuple
+# (Gender, L_1, L_2, L_3, c_L2, L_Sea, Brand, Cup, Fit) built by build_categories().
+_RULE_FIELDS = {"gender": 0, "l1": 1, "l3": 3, "fit": 8}
+_RULE_KEYS   = {"crumb", "new_in", "cup_any", "brand_crumb", *_RULE_FIELDS}
+
+def _compile_category_rules(rules, id_map):
     """
-    Return a single comma-separated breadcrumb string
-    (e.g.  'CLOTHING>Tights,BRANDS>Hanro').
-    The helper is called by transform.build_parent_payload().
+    Turn config.yaml → category_rules into lookup tuples, once at import:
+      (crumb, crumb_id, parent, parent_id, checks, new_in, cup_any, brand_prefix)
+    checks = ((key index, frozenset of allowed values), ...).
+    Unknown keys and breadcrumbs missing from categories.id_map raise here,
+    at startup, instead of halfway through a run.
     """
-    categories = []
+    norm_map = {_normalize_crumb(k): v for k, v in id_map.items()}
 
-    # cast everything to str before .strip(), to guard against ints
-    gender = str(row.get("Gender",   "")).strip()
-    l1     = str(row.get("L_1",      "")).strip()
-    l2     = str(row.get("L_2",      "")).strip()
-    l3     = str(row.get("L_3",      "")).strip()
-    cl2    = str(row.get("c_L2",     "")).strip()
-    season = str(row.get("L_Sea",    "")).strip()
-    brand_name= str(row.get("Brand", "")).strip()
-
-
-    #ALL Current Season
-    if season == current_season_code() and (l2 == "T" or (l2 == "E" and cl2 == "F")):
-      #All New In
-      if gender == "W" and l1 in ("LW", "RW", "UW", "SW", "BW", "AC", "AW", "HW", "NW"):
-        categories.append("NEW IN>All New In")
-      #Clothing
-      if gender == "W" and l1 == "RW":
-        categories.append("NEW IN>Clothing")
-      #Intimates
-      if gender == "W" and l1 == "UW":
-        categories.append("NEW IN>Intimates")
-      #Swimwear
-      if gender == "W" and l1 in ("SW", "BW"):
-        categories.append("NEW IN>Swimwear")
-      #Men's Corner
-      if gender == "M" and l1 in ("LW", "RW", "UW", "SW", "BW", "AC", "AW", "HW", "NW"):
-        categories.append("NEW IN>Men's Corner")
-
-    #Womens
-    if gender == "W":
-      #CLOTHING
-      #All Clothing
-      if l1 in ("RW", "AC", "LW"):
-        categories.append("CLOTHING>All Clothing")
-      #Bodysuits
-      if l3 == "RW BODIES" or l3 == "RW STRING BODIES":
-        categories.append("CLOTHING>Bodysuits")
-      #Tops
-      if l3 in ("RW T-SHIRTS", "RW SHIRTS", "RW TOPS", "RW BLOUSES", "RW TUNICS", "RW SWEATSHIRTS", "RW POLOS"):
-        categories.append("CLOTHING>Tops")
-      #Trousers & Leggings
-      if l3 in ("RW PANTS", "RW LEGGINGS", "LW LEGGINGS"):
-        categories.append("CLOTHING>Trousers & Leggings")
-      #Dresses
-      if l3 == "RW DRESSES":
-        categories.append("CLOTHING>Dresses")
-      #Shorts & Skirts
-      if l3 == "RW SKIRTS" or l3 == "RW SHORTS":
-        categories.append("CLOTHING>Shorts & Skirts")
-      #Activewear
-      if l1 == "AC":
-        categories.append("CLOTHING>Activewear")
-      #Cover Ups
-      if l3 in ("RW BLAZERS", "RW BOLEROS", "RW CARDIGANS", "RW COATS", "RW JACKETS", "RW PONCHOS", "RW TUNICS", "RW VESTS", "RW SUITS"):
-        categories.append("CLOTHING>Cover Ups")
-      #Tights
-      if l3 in ("LW TIGHTS", "LW STAY UPS", "LW KNEE-HIGHS", "LW OVERKNEES"):
-        categories.append("CLOTHING>Tights")
-      #Socks
-      if l3 == "RW SOCKS":
-        categories.append("CLOTHING>Socks")
-      #Accessories
-      if l3 == "RW ACCESSORIES":
-        categories.append("CLOTHING>Accessories")
-
-      #INTIMATES
-      #All Intimates
-      if l1 in ("UW", "NW", "HW", "FW"):
-        categories.append("INTIMATES>All Intimates")
-      #Bras
-      if l3 == "UW BRAS":
-        categories.append("INTIMATES>Bras")
-      #D+ Cups
-      if l1 == "UW" and any(letter in row.get("Cup","") for letter in "DEFGH"):
-        categories.append("INTIMATES>D+ Cups")
-      #Panties
-      if l3 == "UW BRIEFS" or l3 == "UW PANTIES":
-        categories.append("INTIMATES>Panties")
-      #Bodies
-      if l3 == "UW BODIES" or l3 == "UW STRING BODIES":
-        categories.append("INTIMATES>Bodies")
-      #Shape & Control
-      if l1 in ("UW", "NW", "HW") and row.get("Fit","") in ("SH STRONG", "SH MEDIUM", "SH LIGHT"):
-        categories.append("INTIMATES>Shape & Control")
-      #Camisoles & Chemises
-      if l3 == "UW TOPS":
-        categories.append("INTIMATES>Camisoles & Chemises")
-      #Sleep & Lounge
-      if l1 == "NW" or l1 == "HW":
-        categories.append("INTIMATES>Sleep & Lounge")
-      #Slippers
-      if l1 == "FW":
-        categories.append("INTIMATES>Slippers")
-
-      #SWIMWEAR
-      #All Swimwear
-      if l1 == "SW" or l1 == "BW":
-        categories.append("SWIMWEAR>All Swimwear")
-      #1 Piece
-      if l3 == "SW SWIMBODIES":
-        categories.append("SWIMWEAR>1 Piece")
-      #Bikinis
-      if l3 == "SW BIKINI SETS":
-        categories.append("SWIMWEAR>Bikinis")
-      #D+ Cups
-      if l1 == "SW" and any(letter in row.get("Cup","") for letter in "DEFGH"):
-        categories.append("SWIMWEAR>D+ Cups")
-      #Bikini Tops
-      if l3 == "SW SWIMBRAS":
-        categories.append("SWIMWEAR>Bikini Tops")
-      #Bikini Bottoms
-      if l3 == "SW SWIMBRIEFS":
-        categories.append("SWIMWEAR>Bikini Bottoms")
-      #Beachwear
-      if l1 == "BW":
-        categories.append("SWIMWEAR>Beachwear")
-      #Sandals
-      if l3 == "BW SANDALS":
-        categories.append("SWIMWEAR>Sandals")
-
-
-    #Men's Corner
-    if gender == "M":
-      #MEN'S CORNER
-      #All Men's Corner
-      if l1 in ("LW", "RW", "UW", "SW", "BW", "AC", "AW", "HW", "NW"):
-        categories.append("MEN'S CORNER>All Men's Corner")
-      #Underwear
-      if l1 == "UW":
-        categories.append("MEN'S CORNER>Underwear")
-      #Socks
-      if l3 == "LW SOCKS":
-        categories.append("MEN'S CORNER>Socks")
-      #Nightwear
-      if l1 == "NW":
-        categories.append("MEN'S CORNER>Nightwear")
-      #Leisure
-      if l1 == "HW":
-        categories.append("MEN'S CORNER>Leisure")
-      #Swim
-      if l1 == "SW" or l1 == "BW":
-        categories.append("MEN'S CORNER>Swim")
-      #Accesories
-      if l1 == "AC":
-        categories.append("MEN'S CORNER>Accesories")
-
-
-    #Brand Categorization
-    if brand_name:
-      categories.append(f"BRANDS>{brand_name}")
-
-    #Is Living?
-    if l1 == "LV":
-      categories.append("LIVING>All Living")
-
-    # #Join Categories with (,)
-    # return ",".join(categories)        DEPRICATED
-
-    # -------------------------------------------------------
-    # 1)  Add every level-1 'general' category (CLOTHING, SWIMWEAR ...)
-    #     that occurs to the list, if it's not there already.
-    extra_parents = {c.split(">")[0].strip()               # take text before first '>'
-                     for c in categories if ">" in c}      # only crumbs that had a child
-    for parent in extra_parents:
-        if parent and parent not in categories:
-            categories.append(parent)
-
-    # 2)  De-duplicate while preserving the order in which we appended
-    categories = list(dict.fromkeys(categories))
-    # -------------------------------------------------------
-
-    # -- Normalize the config id_map and look up each crumb --
-    bc_cfg = _cfg["categories"]
-    id_map = bc_cfg.get("id_map", {})
-
-    # build a normalized lookup dict once
-    norm_map = { _normalize_crumb(k): v for k, v in id_map.items() }
-
-    result = []
-    for crumb in categories:
+    def _lookup(crumb, where):
         key = _normalize_crumb(crumb)
         if key not in norm_map:
-            raise KeyError(f"Category '{crumb}' (normalized to '{key}') not found in config.yaml id_map")
-        result.append({"id": norm_map[key]})
-    return result
+            raise KeyError(f"{where}: category '{crumb}' (normalized to '{key}') not found in config.yaml id_map")
+        return norm_map[key]
+
+    compiled = []
+    for n, rule in enumerate(rules or [], start=1):
+        where = f"category_rules #{n}"
+        unknown = set(rule) - _RULE_KEYS
+        if unknown:
+            raise ValueError(f"{where}: unknown key(s) {sorted(unknown)}")
+
+        checks = tuple((idx, frozenset(str(v).strip() for v in rule[name]))
+                       for name, idx in _RULE_FIELDS.items() if name in rule)
+        new_in  = bool(rule.get("new_in", False))
+        cup_any = frozenset(str(rule.get("cup_any", "")))
+
+        if "brand_crumb" in rule:                  # "<prefix>>{Brand}", id resolved per brand
+            prefix = str(rule["brand_crumb"]).strip()
+            compiled.append((None, None, prefix, _lookup(prefix, where), checks, new_in, cup_any, prefix))
+            continue
+
+        crumb = str(rule.get("crumb") or "").strip()
+        if not crumb:
+            raise ValueError(f"{where}: needs a 'crumb' or 'brand_crumb'")
+        parent = crumb.split(">")[0].strip() if ">" in crumb else None
+        parent_id = _lookup(parent, where) if parent else None
+        compiled.append((crumb, _lookup(crumb, where), parent, parent_id, checks, new_in, cup_any, None))
+    return compiled, norm_map
+
+_category_rules, _category_ids_by_crumb = _compile_category_rules(
+    _cfg.get("category_rules"), _cfg["categories"].get("id_map", {})
+)
+
+# brands we may upload but could never categorise
+for _brand_rule in (r for r in _category_rules if r[7]):
+    for _b in _filters.get("allowed_brands", []):
+        if _normalize_crumb(f"{_brand_rule[7]}>{_b}") not in _category_ids_by_crumb:
+            print(f"[transform] Warning: no id_map entry for '{_brand_rule[7]} > {_b}'")
+
+@functools.lru_cache(maxsize=None)
+def _category_ids(key, season_now):
+    """Memoized rule evaluation: same input tuple (and season) → same category IDs."""
+    gender, l1, l2, l3, cl2, season, brand, cup, fit = key
+    new_in = season == season_now and (l2 == "T" or (l2 == "E" and cl2 == "F"))
+
+    leaves, parents = {}, {}                       # crumb → id, insertion-ordered
+    for crumb, crumb_id, parent, parent_id, checks, rule_new_in, cup_any, brand_prefix in _category_rules:
+        if rule_new_in and not new_in:
+            continue
+        if any(key[idx] not in allowed for idx, allowed in checks):
+            continue
+        if cup_any and not any(letter in cup for letter in cup_any):
+            continue
+        if brand_prefix:
+            if not brand:
+                continue
+            crumb = f"{brand_prefix}>{brand}"
+            norm = _normalize_crumb(crumb)
+            if norm not in _category_ids_by_crumb:
+                raise KeyError(f"Category '{crumb}' (normalized to '{norm}') not found in config.yaml id_map")
+            crumb_id = _category_ids_by_crumb[norm]
+        leaves.setdefault(_normalize_crumb(crumb), crumb_id)
+        if parent:
+            parents.setdefault(_normalize_crumb(parent), parent_id)
+
+    # every level-1 'general' category (CLOTHING, SWIMWEAR ...) follows its children
+    for norm, parent_id in parents.items():
+        leaves.setdefault(norm, parent_id)
+    return tuple(leaves.values())
+
+def build_categories(row) -> list:
+    """
+    Return the Woo category list ([{"id": ..}, ...]) for one parent row.
+    Rules live in config.yaml → category_rules; see _compile_category_rules().
+    The helper is called by transform.build_parent_payload().
+    """
+    # cast everything to str before .strip(), to guard against ints
+    key = tuple(str(row.get(col) or "").strip() for col in
+                ("Gender", "L_1", "L_2", "L_3", "c_L2", "L_Sea", "Brand", "Cup", "Fit"))
+    return [{"id": cid} for cid in _category_ids(key, season_calendar().current)]
 
 # -------------------------
 # basic-colour meta list
@@ -427,13 +416,96 @@ def all_basic_colors(row):
     return [v for v in vals if v]
 
 
+# -------------------------
+# payload plan (field_map / computed / attributes compiled once)
+# -------------------------
+class PayloadPlan:
+  """
+  config.yaml's field_map, computed and attributes sections turned into flat
+  lists of (key, column) getters, resolved helper callables and attribute
+  templates. build() runs them for one bucket without any dict-driven dispatch.
+  A computed helper that does not exist raises KeyError when the plan is built.
+  """
+
+  def __init__(self, fmap, computed_map, attr_rules, helpers):
+    self.fields = [(woo_key, db_col) for db_col, woo_key in fmap.items() if not woo_key.startswith("meta:")]
+    self.metas  = [(woo_key.split("meta:")[1], db_col) for db_col, woo_key in fmap.items() if woo_key.startswith("meta:")]
+
+    # meta_data is always "field_map metas + basic colours"; a computed meta_data helper replaces the latter
+    self.meta_helper = build_basic_color_meta
+    self.computed = []
+    for field_name, helper_name in computed_map.items():
+      fn = helpers.get(helper_name)
+      if not callable(fn):
+        raise KeyError(f"Missing helper for computed field '{field_name}': '{helper_name}'")
+      if field_name == "meta_data":
+        self.meta_helper = fn
+      else:
+        self.computed.append((field_name, fn, field_name == "images"))   # images also get the SKU
+
+    self.attrs = []
+    for attr_name, rule in attr_rules.items():
+      template = {
+          "id":        rule["id"],            # global attribute ID
+          "name":      attr_name,
+          "visible":   bool(rule["visible"]),
+          "variation": bool(rule["variation"])
+      }
+      # Size is collected from every row, the rest from the first row
+      self.attrs.append((rule["db_col"], rule["db_col"] == "b_Size", template))
+
+  def build(self, first, rows, parent_sku, sizes=None):
+    # --- basic 1:1 field mappings, SKU before computed helpers -------------
+    parent = {"type": "variable"}
+    for woo_key, db_col in self.fields:
+      parent[woo_key] = str(first.get(db_col, "")).strip()
+    parent["sku"] = parent_sku
+
+    # --- computed fields (images, stock_quantity, etc.) --------------------
+    for field_name, fn, takes_sku in self.computed:
+      parent[field_name] = fn(first, parent_sku) if takes_sku else fn(first)
+
+    # --- global-attribute payloads (so Woo shows pills) --------------------
+    parent_attrs = []
+    for db_col, is_size, template in self.attrs:
+      if is_size:
+        if sizes is None:
+          sizes = sort_sizes_naturally([str(r.get(db_col, "")).strip() for r in rows if r.get(db_col)])
+        options = list(sizes)
+      else:
+        raw = str(first.get(db_col, "")).strip()
+        if not raw:
+          continue
+        options = [o.strip() for o in raw.split(",") if o.strip()]
+      parent_attrs.append({**template, "options": options})
+    parent["attributes"] = parent_attrs
+
+    # --- meta_data: 1-to-1 meta mappings + dynamic basic colors ------------
+    meta_list = []
+    for meta_key, db_col in self.metas:
+      val = str(first.get(db_col, "")).strip()
+      if val:
+        meta_list.append({"key": meta_key, "value": val})
+    meta_list += self.meta_helper(first)
+    parent["meta_data"] = meta_list
+    return parent
+
+_plan = None      # built by compile_payload_plan() at the end of this module
+
+def compile_payload_plan() -> PayloadPlan:
+  """(Re)build the payload plan from config.yaml and this module's helpers."""
+  global _plan
+  _plan = PayloadPlan(_fmap, _computed_map, _attr_rules, globals())
+  return _plan
+
 # -------------------------
 # parent payload builder
 # -------------------------
-def build_parent_payload(group_rows):
+def build_parent_payload(group_rows, sizes=None):
   """
   Given all rows for a single parent (same style+color),
   return (parent_sku, parent_payload_dict) or (None, None) to skip.
+  sizes: already sorted size list of the bucket (skips re-sorting).
   """
   first = group_rows[0]
   force_mode = os.getenv("FORCE_UPLOAD") == "1"
@@ -448,68 +520,12 @@ def build_parent_payload(group_rows):
   # --- 2) Season code check ----------------------------------------------
   if not force_mode:
     l_sea = str(first.get("L_Sea", "")).strip()
-    if l_sea not in recent_season_codes():
+    if not season_calendar().is_recent(l_sea):
         print(f"  ↳ SKIP parent '{concat_style_color(first)}': season '{l_sea}' out of date")
         return None, None
 
-  # --- Initialize payload and basic 1:1 field mappings -------------------
-  parent = {"type": "variable"}
-  for db_col, woo_key in _fmap.items():
-      if woo_key.startswith("meta:"):
-          continue
-      parent[woo_key] = str(first.get(db_col, "")).strip()
-
-  # --- SKU must exist before computed helpers ----------------------------
   parent_sku = concat_style_color(first)
-  parent["sku"] = parent_sku
-
-  # --- Dispatch computed fields (images, stock_quantity, etc.) -----------
-  for field_name, helper_name in _computed_map.items():
-      fn = globals().get(helper_name)
-      if not fn:
-          raise KeyError(f"Missing helper for computed field '{field_name}': '{helper_name}'")
-      if field_name == "images":
-          parent[field_name] = fn(first, parent_sku)
-      else:
-          parent[field_name] = fn(first)
-
-  # --- Build global‐attribute payloads (so Woo shows pills) ---------------
-  parent_attrs = []
-  for attr_name, rule in _attr_rules.items():
-      # Special‐case Size: collect from every row
-      if rule["db_col"] == "b_Size":
-          raw_sizes = [str(r.get("b_Size","")).strip() for r in group_rows if r.get("b_Size")]
-          options = sort_sizes_naturally(raw_sizes)
-      else:
-          raw = str(first.get(rule["db_col"], "")).strip()
-          if not raw:
-              continue
-          options = [o.strip() for o in raw.split(",") if o.strip()]
-
-      parent_attrs.append({
-          "id":        rule["id"],            # global attribute ID
-          "name":      attr_name,
-          "options":   options,
-          "visible":   bool(rule["visible"]),
-          "variation": bool(rule["variation"])
-      })
-  parent["attributes"] = parent_attrs
-
-  # --- Build meta_data: 1-to-1 meta mappings + dynamic basic colors ------
-  meta_list = []
-  # 1) Any field_map entries starting with "meta:"
-  for db_col, woo_key in _fmap.items():
-      if woo_key.startswith("meta:"):
-          meta_key = woo_key.split("meta:")[1]
-          val = str(first.get(db_col, "")).strip()
-          if val:
-              meta_list.append({"key": meta_key, "value": val})
-
-  # 2) Your dynamic basic-color metas (only non-empty ones)
-  meta_list += build_basic_color_meta(first)
-  parent["meta_data"] = meta_list
-
-  return parent_sku, parent
+  return parent_sku, _plan.build(first, group_rows, parent_sku, sizes)
 
 # -------------------------
 # child / variation builder
@@ -525,7 +541,7 @@ def build_variation_payload(row, parent_sku, position):
   size_opt  = str(row["b_Size"]).strip()
 
   payload = {
-      "sku":            f"{parent_sku}-{size_opt}",
+      "sku":            variation_sku(parent_sku, size_opt),
       "regular_price":  str(row["RP"]).strip(),
       "manage_stock":   True,
       "stock_quantity": calculate_safe_stock(row),
@@ -557,17 +573,22 @@ def group_rows(rows):
 
 def build_parent_and_children(rows):
   """Given list[dict] (same parent), return parentJSON, [childJSONs]"""
-  parent = build_parent_payload(rows)
+  sizes_sorted, row_by_size, duplicates = _size_order.index_rows(rows)
+  parent = build_parent_payload(rows, sizes=sizes_sorted)
   if parent[0] is None:
       return None, []     # no parent, no children
 
   parent_sku, parent_json = parent
+  for dup in duplicates:
+      print(f"  ↳ WARN parent '{parent_sku}': duplicate size '{str(dup['b_Size']).strip()}' "
+            f"(row {dup['id']}) ignored, using row {row_by_size[str(dup['b_Size']).strip()]['id']}")
 
-  sizes_sorted = sort_sizes_naturally([r["b_Size"] for r in rows])
   children_json = []
   for pos, size in enumerate(sizes_sorted, start=1):
-      # pick the row that matches this size
-      row = next(r for r in rows if r["b_Size"].strip() == size)
+      row = row_by_size[size]
       variation_payload = build_variation_payload(row, parent_sku, pos)
       children_json.append((variation_payload, row["id"]))
   return parent_json, children_json
+
+# compile once all helpers above exist – a bad computed helper fails here, at startup
+compile_payload_plan()
@@ -1,22 +1,468 @@
 # woo_api.py
-import os, yaml, pathlib
+import os, random, threading, time
+from email.utils import parsedate_to_datetime
+from json import dumps as jsonencode
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
 from woocommerce import API
+from woocommerce.oauth import OAuth
+from settings import load_settings
+from media_cache import MediaCache
+from image_check import ImagePreflight
+
+try:                      # optional: only needed for woo_api.http2
+    import httpx
+except ImportError:
+    httpx = None
+
+_woo_cfg = load_settings().woo_api
+
+# Woo error codes that mean "a product with this SKU already exists"
+_SKU_CONFLICT_CODES = ("product_invalid_sku", "woocommerce_rest_product_not_created")
+_IMAGE_ERROR_CODE = "woocommerce_product_image_upload_error"
+# ... a cached media ID whose attachment was deleted from the library
+_STALE_IMAGE_CODE = "woocommerce_product_invalid_image_id"
+# ... and "the ID we sent no longer exists" (deleted in wp-admin since we indexed it)
+_STALE_ID_CODES = ("woocommerce_rest_product_invalid_id", "woocommerce_rest_product_variation_invalid_id",
+                   "woocommerce_rest_invalid_id")
+
+
+# -------------------------
+# local SKU → Woo ID index
+# -------------------------
+class SkuIndex:
+    """
+    Thread-safe map SKU → (woo_id, parent_id); parent_id is None for parents.
+    Seeded from the sync table and/or a paginated product listing, then kept
+    up to date from every create/update answer, so the client can go straight
+    to create or update instead of create → conflict → GET → PUT.
+    """
+
+    def __init__(self):
+        self._ids  = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, sku, parent_id=None):
+        """Woo ID for sku, only if it hangs under parent_id (None = top-level product)."""
+        with self._lock:
+            hit = self._ids.get(sku)
+        if hit and hit[1] == parent_id:
+            return hit[0]
+        return None
+
+    def add(self, sku, woo_id, parent_id=None):
+        if sku and woo_id:
+            with self._lock:
+                self._ids[sku] = (woo_id, parent_id)
+
+    def discard(self, sku):
+        with self._lock:
+            self._ids.pop(sku, None)
+
+# -------------------------
+# shared keep-alive HTTP session (one per process)
+# -------------------------
+_session = None
+_session_lock = threading.Lock()
+
+def shared_session():
+    """
+    Return the process-wide pooled session, built once from woo_api config:
+      pool_size  → max kept-alive connections to the shop
+      http2      → use httpx with HTTP/2 (falls back to requests if httpx is missing)
+    Every Woo instance (main.py, product_updater.py, product_deleter.py) sends through it.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = _woo_cfg.pool_size
+            if _woo_cfg.http2 and httpx is None:
+                print("[Woo] Warning: http2 requested but httpx is not installed (pip install 'httpx[http2]'), using HTTP/1.1")
+            if _woo_cfg.http2 and httpx is not None:
+                _session = httpx.Client(
+                    http2  = True,
+                    verify = _woo_cfg.verify_ssl,
+                    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                )
+            else:
+                _session = requests.Session()
+                adapter  = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                _session.mount("https://", adapter)
+                _session.mount("http://",  adapter)
+        return _session
+
+
+# -------------------------
+# adaptive pacing shared by every Woo call of the process
+# -------------------------
+class AdaptiveThrottle:
+    """
+    Thread-safe AIMD pacing:
+      • every request waits for its slot, 1/rate seconds after the previous one
+      • fast successful answers raise the rate additively (≈ +increase req/s per second)
+      • slow (> target_latency per unit of work), throttled or failed answers cut it
+        by `decrease`, at most once per cooldown so one burst of errors is one cut
+      • Retry-After pauses all callers until that moment
+    The rate always stays within [min_rate, max_rate].
+    """
+
+    def __init__(self, rate, min_rate=0.5, max_rate=20, target_latency=2.0, increase=1.0, decrease=0.5,
+                 cooldown=1.0, clock=time.monotonic, sleep=time.sleep):
+        self.min_rate, self.max_rate = float(min_rate), float(max_rate)
+        self.rate = min(self.max_rate, max(self.min_rate, float(rate or max_rate)))
+        self.target_latency = target_latency
+        self.increase, self.decrease, self.cooldown = increase, decrease, cooldown
+        self.clock, self.sleep = clock, sleep
+        self._next = self._paused_until = self._last_cut = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now  = self.clock()
+            slot = max(now, self._next, self._paused_until)
+            self._next = slot + 1 / self.rate
+        if slot > now:
+            self.sleep(slot - now)
+
+    def record(self, latency, ok, units=1):
+        """units: work in the request (batch items + images to sideload); a batch may take longer."""
+        with self._lock:
+            if ok and latency <= self.target_latency * units:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            elif self.clock() - self._last_cut >= self.cooldown:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_cut = self.clock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket for a fixed pace (woo_api.adaptive off): `rate` requests
+    per second, bursts of up to `burst`. Same interface as AdaptiveThrottle.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate     = float(rate)
+        self.capacity = float(burst or max(1, self.rate))
+        self.tokens   = self.capacity
+        self.clock, self.sleep = clock, sleep
+        self.updated  = self.clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self.clock()
+            self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            wait = max(-self.tokens / self.rate, self._paused_until - now)   # tokens < 0: slot reserved ahead
+        if wait > 0:
+            self.sleep(wait)
+
+    def record(self, latency, ok, units=1):
+        pass
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+# -------------------------
+# circuit breaker: fail fast while the shop is down
+# -------------------------
+class CircuitOpenError(Exception):
+    """Woo is considered down; the call was not sent. Stop and resume later."""
+
+
+class CircuitBreaker:
+    """
+    closed    → calls go through; `threshold` consecutive failures (5xx, timeouts,
+                connection errors) open the circuit
+    open      → every call raises CircuitOpenError at once, for `reset_timeout` seconds
+    half-open → one probe call is let through: success closes, failure re-opens
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold, self.reset_timeout, self.clock = threshold, reset_timeout, clock
+        self.failures  = 0
+        self.opened_at = None
+        self._probing  = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def before(self):
+        """Raise CircuitOpenError unless this call may go out."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._probing:
+                self._probing = True                 # this call is the probe
+                return
+        raise CircuitOpenError(f"Woo circuit open after {self.failures} consecutive failures")
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("[Woo] Circuit closed – shop answers again")
+            self.failures, self.opened_at, self._probing = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    print(f"[Woo] Circuit opened after {self.failures} consecutive failures")
+                self.opened_at = self.clock()
+            self._probing = False
+
+    def release(self):
+        """The call ended without a verdict on the shop (e.g. a local error): free the probe slot."""
+        with self._lock:
+            self._probing = False
+
+
+_throttle = None
+_breaker  = None
+
+def shared_breaker():
+    """Process-wide CircuitBreaker from woo_api config (None when breaker_threshold is 0)."""
+    global _breaker
+    with _session_lock:
+        if _breaker is None and _woo_cfg.breaker_threshold > 0:
+            _breaker = CircuitBreaker(_woo_cfg.breaker_threshold, _woo_cfg.breaker_reset)
+        return _breaker
+
+
+def shared_throttle():
+    """
+    Process-wide pacing of every Woo request: AdaptiveThrottle when woo_api.adaptive is on,
+    else a RateLimiter at woo_api.rate_limit (None when that is 0 = unlimited).
+    """
+    global _throttle
+    with _session_lock:
+        if _throttle is None and _woo_cfg.adaptive:
+            _throttle = AdaptiveThrottle(_woo_cfg.rate_limit, _woo_cfg.min_rate, _woo_cfg.max_rate,
+                                         _woo_cfg.target_latency)
+        elif _throttle is None and _woo_cfg.rate_limit > 0:
+            _throttle = RateLimiter(_woo_cfg.rate_limit, _woo_cfg.rate_burst)
+        return _throttle
+
+
+def _retry_after(resp):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP date), else None."""
+    value = resp.headers.get("retry-after") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _work_units(data):
+    """Rough amount of work in a request body: batch items plus the images Woo has to sideload."""
+    if not isinstance(data, dict):
+        return 1
+    batch = [item for key in ("create", "update", "delete") for item in data.get(key) or []]
+    items = [item for item in batch if isinstance(item, dict)] if batch else [data]
+    return max(1, len(batch)) + sum(len(item.get("images") or []) for item in items)
+
+
+_IDEMPOTENT = ("GET", "PUT", "DELETE", "OPTIONS", "HEAD")
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+_TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) \
+                    + ((httpx.TransportError,) if httpx else ())
+
+
+class PooledAPI(API):
+    """
+    woocommerce.API that sends every request through the shared keep-alive session
+    (no new TCP/TLS handshake per call) with separate connect/read timeouts.
+    Same get/post/put/delete interface, so `woo.wc.put(...)` callers are unchanged.
+    """
+
+    def __init__(self, url, consumer_key, consumer_secret, connect_timeout=5, **kwargs):
+        super().__init__(url, consumer_key, consumer_secret, **kwargs)
+        self.connect_timeout = connect_timeout
+        self.session  = shared_session()
+        self.throttle = shared_throttle()
+        self.breaker  = shared_breaker()
+        self.retries  = _woo_cfg.retries
+
+    def _send(self, method, endpoint, data=None, params=None, idempotent=None, **kwargs):
+        """
+        One logical call: paced by the shared throttle, retried with jittered backoff.
+        GET/PUT/DELETE (or idempotent=True, e.g. batch updates) are retried on 5xx,
+        429 and connection errors; other POSTs only on 429, where the shop did not
+        process the request. The circuit breaker gets one verdict per logical call.
+        """
+        retryable = method in _IDEMPOTENT if idempotent is None else idempotent
+        if self.breaker:
+            self.breaker.before()
+        try:
+            resp = self._attempts(method, endpoint, data, params, retryable, _work_units(data), **kwargs)
+        except _TRANSIENT_ERRORS:
+            if self.breaker:
+                self.breaker.failure()
+            raise
+        except BaseException:
+            if self.breaker:
+                self.breaker.release()                 # never leave a half-open probe hanging
+            raise
+        if self.breaker and resp.status_code >= 500:
+            self.breaker.failure()
+        elif self.breaker:
+            self.breaker.success()
+        return resp
+
+    def _attempts(self, method, endpoint, data, params, retryable, units, **kwargs):
+        for attempt in range(self.retries + 1):
+            if self.throttle:
+                self.throttle.acquire()
+            started = time.monotonic()
+            try:
+                resp = self._send_once(method, endpoint, data, params, **kwargs)
+            except _TRANSIENT_ERRORS:
+                if self.throttle:
+                    self.throttle.record(time.monotonic() - started, ok=False, units=units)
+                if not retryable or attempt == self.retries:
+                    raise
+                time.sleep(_woo_cfg.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+
+            status = resp.status_code
+            if self.throttle:
+                self.throttle.record(time.monotonic() - started, ok=status < 500 and status != 429, units=units)
+            if status not in _RETRY_STATUS or attempt == self.retries or not (retryable or status == 429):
+                return resp
+            wait = _retry_after(resp)
+            if wait is not None and self.throttle:
+                self.throttle.pause(wait)              # everybody waits, not just this thread
+            backoff = _woo_cfg.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f"[Woo] {status} on {method} {endpoint}, retry {attempt + 1}/{self.retries}")
+            time.sleep(max(wait or 0.0, backoff))
+        return resp
+
+    def _send_once(self, method, endpoint, data=None, params=None, **kwargs):
+        url = f"{self.url.rstrip('/')}/{'wp-json' if self.wp_api else 'wc-api'}/{self.version}/{endpoint}"
+        params = dict(params or {})
+        auth = (self.consumer_key, self.consumer_secret)
+        if not self.is_ssl:
+            # plain http: OAuth1-signed URL, the query is part of the signature
+            url = OAuth(url=f"{url}?{urlencode(params)}", consumer_key=self.consumer_key,
+                        consumer_secret=self.consumer_secret, version=self.version, method=method,
+                        oauth_timestamp=int(time.time())).get_oauth_url()
+            params, auth = {}, None
+        elif self.query_string_auth:
+            params.update({"consumer_key": self.consumer_key, "consumer_secret": self.consumer_secret})
+            auth = None
+        headers = {"user-agent": self.user_agent, "accept": "application/json"}
+        if data is not None:
+            data = jsonencode(data, ensure_ascii=False).encode("utf-8")
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        if httpx is not None and isinstance(self.session, httpx.Client):
+            return self.session.request(
+                method, url, params=params, content=data, headers=headers, auth=auth,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout), **kwargs
+            )
+        return self.session.request(
+            method, url, params=params, data=data, headers=headers, auth=auth,
+            timeout=(self.connect_timeout, self.timeout), verify=self.verify_ssl, **kwargs
+        )
+
+    def get(self, endpoint, **kwargs):
+        return self._send("GET", endpoint, None, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        return self._send("POST", endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        return self._send("PUT", endpoint, data, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self._send("DELETE", endpoint, None, **kwargs)
+
+    def options(self, endpoint, **kwargs):
+        return self._send("OPTIONS", endpoint, None, **kwargs)
 
-_cfg = yaml.safe_load(pathlib.Path("config.yaml").read_text(encoding="utf-8"))
 
 class Woo:
     def __init__(self, debug=False):
-        woo_cfg = _cfg.get("woo_api", {})
         # 1) Read your keys from ENV and YAML
-        self.wc = API(
+        self.wc = PooledAPI(
             url         = os.getenv("WOO_SITE_URL"),
             consumer_key= os.getenv("WOO_CK"),
             consumer_secret=os.getenv("WOO_CS"),
-            version     = woo_cfg.get("version", "wc/v3"),
-            timeout     = woo_cfg.get("timeout", 20)
+            version     = _woo_cfg.version,
+            timeout     = _woo_cfg.timeout,
+            connect_timeout = _woo_cfg.connect_timeout,
+            verify_ssl  = _woo_cfg.verify_ssl
         )
+        self.batch_size = _woo_cfg.batch_size   # Woo caps batch requests at 100 items
+        self.skus  = SkuIndex()
+        img_cfg    = load_settings().images
+        self.media = MediaCache(img_cfg.media_cache_file)
+        session = self.wc.session if isinstance(self.wc.session, requests.Session) else None   # httpx: own session
+        self.preflight = ImagePreflight(session, ttl=img_cfg.preflight_ttl, workers=img_cfg.preflight_workers,
+                                        timeout=_woo_cfg.connect_timeout, throttle=self.wc.throttle,
+                                        breaker=self.wc.breaker) if img_cfg.preflight else None
         self.debug = debug
 
+    def _check_images(self, payloads):
+        """Drop images whose URL is missing (HEAD pre-flight); URLs linked by media ID are not checked."""
+        if not self.preflight:
+            return payloads
+        return self.preflight.strip(payloads, known=self.media.__contains__)
+
+    def _with_images(self, payload, mode):
+        """payload for one attempt: "ids" = known images by media ID, "src" = as built, "none" = no images."""
+        if mode == "none":
+            return {k: v for k, v in payload.items() if k != "images"}
+        if mode == "ids" and payload.get("images"):
+            return {**payload, "images": self.media.swap(payload["images"])}
+        return payload
+
+    def prefetch_skus(self):
+        """Fill the SKU index from a paginated products listing (id + sku only). Returns the count added."""
+        added, page = 0, 1
+        while True:
+            try:
+                chunk = self.wc.get("products", params={"per_page": 100, "page": page, "_fields": "id,sku"}).json()
+            except CircuitOpenError:
+                raise
+            except Exception as ex:
+                print(f"[Woo] Warning: SKU prefetch stopped at page {page}: {ex}")
+                break
+            if not isinstance(chunk, list) or not chunk:
+                break
+            for prod in chunk:
+                if prod.get("sku"):
+                    self.skus.add(prod["sku"], prod["id"])
+                    added += 1
+            if len(chunk) < 100:
+                break
+            page += 1
+        print(f"[Woo] SKU index: prefetched {added} product SKU(s)")
+        return added
+
     def post_product(self, data):
         """
         Create or update a product.
@@ -26,34 +472,70 @@ class Woo:
         if self.debug:
             print("[Woo] POST /products payload:", data)
 
-        # try create
         def _create_or_update(payload):
-            """Helper: try create, then on SKU conflict update."""
+            """Helper: update if the SKU is indexed, else create; on SKU conflict update."""
+            sku = payload.get("sku")
+            known_id = self.skus.get(sku)
+            if known_id:
+                r = self.wc.put(f"products/{known_id}", payload).json()
+                if r.get("code") not in _STALE_ID_CODES:
+                    self.skus.add(sku, r.get("id"))
+                    return r
+                self.skus.discard(sku)                  # deleted on Woo since → create again
+
             r = self.wc.post("products", payload).json()
-            if r.get("code") in ("product_invalid_sku", "woocommerce_rest_product_not_created"):
+            if r.get("code") in _SKU_CONFLICT_CODES:
                 # Attempt to find existing product by SKU
-                existing = self.wc.get("products", params={"sku": payload["sku"]}).json()
-                if existing:
-                    prod_id = existing[0]["id"]
+                prod_id = self._find_ids_by_sku([sku]).get(sku)
+                if prod_id:
                     if self.debug:
                         print(f"[Woo] SKU exists, updating product {prod_id}")
                     r = self.wc.put(f"products/{prod_id}", payload).json()
                 else:
                     # No existing product found—log and return original error
-                    print(f"[Woo] Warning: SKU conflict for '{payload['sku']}' but no existing product found.")
+                    print(f"[Woo] Warning: SKU conflict for '{sku}' but no existing product found.")
+            self.skus.add(sku, r.get("id"))
             return r
 
-        # 1) Try full payload
-        resp = _create_or_update(data)
+        # 1) Try full payload, already-uploaded images linked by media ID, missing ones dropped
+        data = self._check_images([data])[0]
+        mode = "ids"
+        resp = _create_or_update(self._with_images(data, mode))
+
+        # 2) A cached media ID no longer exists → forget it and sideload from the URL again
+        if resp.get("code") == _STALE_IMAGE_CODE:
+            self.media.forget(data.get("images"))
+            mode = "src"
+            resp = _create_or_update(data)
 
-        # 2) If image fetch error, retry without images (and handle SKU conflict again)
-        if resp.get("code") == "woocommerce_product_image_upload_error":
+        # 3) If image fetch error, retry without images (and handle SKU conflict again)
+        if resp.get("code") == _IMAGE_ERROR_CODE:
             print(f"[Woo] Warning: image upload failed for SKU {data.get('sku')}, retrying without images…")
-            data_no_images = {k: v for k, v in data.items() if k != "images"}
-            resp = _create_or_update(data_no_images)
+            mode = "none"
+            resp = _create_or_update(self._with_images(data, mode))
+
+        if mode != "none" and resp.get("id"):
+            self.media.learn(data.get("images"), resp.get("images"))
         return resp
 
 
+    def attach_images(self, product_id, images, sku=None):
+        """
+        PUT only the "images" of an existing product (the image lane of sync_engine.py).
+        Same image handling as post_product: missing URLs dropped, known ones linked
+        by media ID, a deleted media ID re-sent by URL. Returns the JSON response dict.
+        """
+        data = self._check_images([{"sku": sku, "images": images}])[0]
+        if not data["images"]:
+            return {"id": product_id, "images": []}
+        resp = self.wc.put(f"products/{product_id}", {"images": self.media.swap(data["images"])}).json()
+        if resp.get("code") == _STALE_IMAGE_CODE:
+            self.media.forget(data["images"])
+            resp = self.wc.put(f"products/{product_id}", {"images": data["images"]}).json()
+        if resp.get("id"):
+            self.media.learn(data["images"], resp.get("images"))
+        return resp
+
     def post_variation(self, parent_id, data):
         """
         Create or update a variation under parent_id.
@@ -62,9 +544,210 @@ class Woo:
         if self.debug:
             print(f"[Woo] POST /products/{parent_id}/variations payload:", data)
 
+        sku = data.get("sku")
+        known_id = self.skus.get(sku, parent_id)
+        if known_id:
+            resp = self.wc.put(f"products/{parent_id}/variations/{known_id}", data).json()
+            if resp.get("code") not in _STALE_ID_CODES:
+                return resp
+            self.skus.discard(sku)
+
         resp = self.wc.post(f"products/{parent_id}/variations", data).json()
-        # if SKU conflict, Woo returns product_invalid_sku
-        if resp.get("code") == "product_invalid_sku":
-            # you could implement an update-on-conflict here if desired
-            raise Exception(f"Variation SKU conflict: {resp}")
-        return resp
\ No newline at end of file
+        # if SKU conflict, Woo returns product_invalid_sku → the variation exists, update it
+        if resp.get("code") in _SKU_CONFLICT_CODES:
+            var_id = self._find_variation_ids(parent_id).get(sku)
+            if not var_id:
+                raise Exception(f"Variation SKU conflict: {resp}")
+            resp = self.wc.put(f"products/{parent_id}/variations/{var_id}", data).json()
+        self.skus.add(sku, resp.get("id"), parent_id)
+        return resp
+
+    def _batch(self, endpoint, action, payloads):
+        """
+        Send payloads to <endpoint>/batch as {action: [...]} in chunks of batch_size.
+        Returns exactly one result dict per payload, in the same order.
+        If a whole chunk fails, every item of it gets the same "error" dict.
+        """
+        results = []
+        for start in range(0, len(payloads), self.batch_size):
+            chunk = payloads[start:start + self.batch_size]
+            if self.debug:
+                print(f"[Woo] POST /{endpoint}/batch {action} ({len(chunk)} items):", chunk)
+
+            try:
+                # updates only set fields, so re-sending them after a 5xx / timeout is safe
+                resp = self.wc.post(f"{endpoint}/batch", {action: chunk}, idempotent=action == "update").json()
+            except CircuitOpenError:
+                raise                                   # shop is down: let the caller pause the run
+            except Exception as ex:
+                resp = {"code": "batch_request_failed", "message": str(ex)}
+            if not isinstance(resp, dict):
+                resp = {"code": "batch_failed", "message": str(resp)}
+
+            items = resp.get(action)
+            if not isinstance(items, list) or len(items) != len(chunk):
+                # auth, timeout or malformed answer – report it per item
+                err = {"code": resp.get("code", "batch_failed"), "message": resp.get("message", str(resp))}
+                items = [{"error": err} for _ in chunk]
+            results.extend(items)
+        return results
+
+    def _find_ids_by_sku(self, skus):
+        """Return {sku: product_id} for the products that already own these SKUs (index first, then Woo)."""
+        found = {}
+        skus_all = list(skus)
+        skus = [sku for sku in dict.fromkeys(skus_all) if not self.skus.get(sku)]
+        for start in range(0, len(skus), self.batch_size):
+            chunk = skus[start:start + self.batch_size]
+            try:
+                existing = self.wc.get("products", params={"sku": ",".join(chunk), "per_page": len(chunk)}).json()
+            except CircuitOpenError:
+                raise
+            except Exception as ex:
+                print(f"[Woo] Warning: SKU lookup failed for {len(chunk)} product(s): {ex}")
+                continue
+            if isinstance(existing, list):
+                for prod in existing:
+                    if prod.get("sku") in chunk:
+                        self.skus.add(prod["sku"], prod["id"])
+        for sku in dict.fromkeys(skus_all):
+            if self.skus.get(sku):
+                found[sku] = self.skus.get(sku)
+        return found
+
+    def _find_variation_ids(self, parent_id):
+        """List every variation of parent_id once, index them and return {sku: variation_id}."""
+        found, page = {}, 1
+        while True:
+            try:
+                chunk = self.wc.get(f"products/{parent_id}/variations",
+                                    params={"per_page": 100, "page": page, "_fields": "id,sku"}).json()
+            except CircuitOpenError:
+                raise
+            except Exception as ex:
+                print(f"[Woo] Warning: variation lookup failed for parent {parent_id}: {ex}")
+                break
+            if not isinstance(chunk, list) or not chunk:
+                break
+            for var in chunk:
+                if var.get("sku"):
+                    found[var["sku"]] = var["id"]
+                    self.skus.add(var["sku"], var["id"], parent_id)
+            if len(chunk) < 100:
+                break
+            page += 1
+        return found
+
+    def _upsert(self, endpoint, payloads, parent_id=None):
+        """
+        Send payloads (dicts with "sku") to <endpoint>/batch: SKUs in the index go
+        straight to "update", the rest to "create". Create answers that hit a SKU
+        conflict are looked up and re-sent as one batched update; stale indexed IDs
+        are re-created. Returns one result dict per payload, in input order.
+        """
+        results = [None] * len(payloads)
+        known   = [self.skus.get(p.get("sku"), parent_id) for p in payloads]
+        creates = [i for i, k in enumerate(known) if not k]
+        updates = [i for i, k in enumerate(known) if k]
+
+        # 1) known SKUs → update directly
+        for i, item in zip(updates, self._batch(endpoint, "update", [{**payloads[i], "id": known[i]} for i in updates])):
+            if _error_code(item) in _STALE_ID_CODES:
+                self.skus.discard(payloads[i].get("sku"))
+                creates.append(i)
+            else:
+                results[i] = item
+
+        # 2) the rest → create; duplicates become updates
+        conflicts = []
+        for i, item in zip(creates, self._batch(endpoint, "create", [payloads[i] for i in creates])):
+            results[i] = item
+            if _error_code(item) in _SKU_CONFLICT_CODES:
+                conflicts.append(i)
+        if conflicts:
+            skus = [payloads[i]["sku"] for i in conflicts]
+            ids  = self._find_variation_ids(parent_id) if parent_id else self._find_ids_by_sku(skus)
+            to_update = []
+            for i in conflicts:
+                if ids.get(payloads[i]["sku"]):
+                    to_update.append(i)
+                else:
+                    print(f"[Woo] Warning: SKU conflict for '{payloads[i]['sku']}' but no existing product found.")
+            if self.debug and to_update:
+                print(f"[Woo] {len(to_update)} SKU(s) exist, updating in batch")
+            fixes = [{**payloads[i], "id": ids[payloads[i]["sku"]]} for i in to_update]
+            for i, item in zip(to_update, self._batch(endpoint, "update", fixes)):
+                results[i] = item
+
+        for p, item in zip(payloads, results):
+            if item.get("id") and "error" not in item:
+                self.skus.add(p.get("sku"), item["id"], parent_id)
+        return results
+
+    def post_products_batch(self, payloads):
+        """
+        Create (or update, for SKUs already in the index) many parent products via products/batch.
+        Per-item answers are split into three buckets:
+          - created       → kept as-is
+          - SKU conflict  → looked up by SKU and re-sent as one batched update
+          - image error   → re-sent once without "images" (same create/update flow)
+        Known images go out as {"id": media_id}; a deleted media ID is forgotten
+        and that item is re-sent with the plain URLs.
+        Returns one result dict per payload, in input order.
+        """
+        results = []
+        for start in range(0, len(payloads), self.batch_size):
+            results.extend(self._post_products_chunk(payloads[start:start + self.batch_size]))
+        return results
+
+    def _post_products_chunk(self, payloads):
+        """One batch_size chunk of post_products_batch(); its images are pre-flighted just before it goes out."""
+        payloads = self._check_images(payloads)
+        results  = [None] * len(payloads)
+        mode     = dict.fromkeys(range(len(payloads)), "ids")
+        pending = list(mode)
+
+        while pending:
+            sent  = [self._with_images(payloads[i], mode[i]) for i in pending]
+            retry = []
+            for i, item in zip(pending, self._upsert("products", sent)):
+                results[i] = item
+                code = _error_code(item)
+                if code == _STALE_IMAGE_CODE and mode[i] == "ids":
+                    self.media.forget(payloads[i].get("images"))
+                    mode[i] = "src"
+                    retry.append(i)
+                elif code == _IMAGE_ERROR_CODE and mode[i] != "none":
+                    print(f"[Woo] Warning: image upload failed for SKU {payloads[i].get('sku')}, retrying without images…")
+                    mode[i] = "none"
+                    retry.append(i)
+                elif mode[i] != "none" and item.get("id") and "error" not in item:
+                    self.media.learn(payloads[i].get("images"), item.get("images"))
+            pending = retry
+        return results
+
+    def post_variations_batch(self, parent_id, variations):
+        """
+        Create many variations under parent_id via products/<id>/variations/batch
+        (indexed SKUs are updated instead, duplicate SKUs become updates).
+        `variations` is the [(payload, row_id), ...] list from build_parent_and_children().
+        Woo answers every item in request order, so each result is zipped back
+        to its row_id. Returns [(row_id, payload, item_resp), ...]; a failed
+        item carries an "error" dict instead of a usable "id".
+        """
+        items = self._upsert(f"products/{parent_id}/variations", [var for var, _ in variations], parent_id)
+        return [(row_id, var, item) for (var, row_id), item in zip(variations, items)]
+
+    def update_batch(self, endpoint, payloads):
+        """
+        Batched PUT: send [{"id": ..., <fields>}, ...] to <endpoint>/batch as "update".
+        endpoint is "products" for simple products or "products/<parent>/variations".
+        Returns one result dict per payload, in input order.
+        """
+        return self._batch(endpoint, "update", payloads)
+
+
+def _error_code(item):
+    """Error code of one batch item (or of a plain error response), else None."""
+    err = item.get("error") if isinstance(item.get("error"), dict) else item
+    return err.get("code")